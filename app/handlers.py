@@ -3,10 +3,12 @@
 from functools import wraps, partial
 from datetime import datetime
 import logging
+import re
+import time
 
 from google.appengine.api import users
 
-from bottle import route, redirect, request, url, abort, template as base_template, get, post, put, delete, install
+from bottle import route, redirect, request, url, abort, template as base_template, get, post, put, delete, install, prepare_all
 import bottleext
 import unidecode
 import markdown
@@ -38,28 +40,92 @@ def is_admin():
 def current_user():
 	return users.get_current_user()
 
+def render_markdown(text):
+    """
+    Return the html of a post body and its table of contents ('' if the
+    post has no headers)
+    """
+    md = markdown.Markdown(extensions=['toc'])
+    return md.convert(text), md.toc
+
+SLUG_SEPARATORS = re.compile(r'\W+')
+slug_cache = {}  # title -> slug of recently saved titles
+
 def slugify(str):
-    str = unidecode.unidecode(str).lower().strip()
-    return re.sub(r'\W+','-',str)    
+    try:
+        return slug_cache[str]
+    except KeyError:
+        pass
+    slug = SLUG_SEPARATORS.sub('-', unidecode.unidecode(str).lower()).strip('-')
+    if len(slug_cache) >= 256: slug_cache.clear()
+    slug_cache[str] = slug
+    return slug
 
 
 ###############################################################################
 #                     init                                                    #
 ###############################################################################
 settings = dict(globals = {"app_config":config, "current_user" : current_user, "is_admin" : is_admin, "url_for" : url})
-template = partial(base_template, 
-                             template_adapter=bottleext.MyJinja2Template, 
-                             template_settings=settings,
-                             template_lookup=["./app/templates"]) 
+template_options = dict(template_adapter=bottleext.MyJinja2Template, 
+                        template_settings=settings,
+                        template_lookup=["./app/templates"])
+template = partial(base_template, **template_options) 
 
 
 install(bottleext.JSONAPIPlugin())       
 
+# Per route timing, see /_stats (main.py adds the StatsMiddleware)
+stats = None
+if getattr(config, 'STATS', False):
+    stats = install(bottleext.StatsPlugin())
+    template = stats.timed('template', template)
+
+# Page templates compiled by the warmup request (layout.html is pulled in by these)
+PAGE_TEMPLATES = ['index.html', 'post_edit.html', 'post_show.html', 'post_by.html', 'drafts.html']
+
                      
 ###############################################################################
 #            controllers                                                      #
 ###############################################################################
 
+#--------------------------------------------------------------------------------------------------
+@get('/_ah/warmup')
+def warmup():
+    """
+    Called by App Engine before a new instance gets traffic
+    """
+    prepare_all(templates=PAGE_TEMPLATES, **template_options)
+    render_markdown(u'# warmup')
+    return ''
+
+@get('/_stats', json=True)
+@login_required
+def server_stats():
+    """
+    Request timing per route, if config.STATS is enabled
+    """
+    if not stats: abort(404, 'Enable STATS in config.py')
+    return stats.report()
+
+# Data migrations, each one a function (cursor) -> (entities changed, next
+# cursor or None when done)
+MIGRATIONS = {'post_bodies': Post.migrate_bodies, 'slugs': Slug.backfill}
+
+@post('/_migrate/<name>', json=True)
+@login_required
+def migrate(name):
+    """
+    Run a data migration for up to 20 seconds. Post again with the returned
+    cursor until it is None
+    """
+    if name not in MIGRATIONS: abort(404, 'No such migration')
+    cursor, changed, deadline = request.forms.cursor or None, 0, time.time() + 20
+    while True:
+        n, cursor = MIGRATIONS[name](cursor)
+        changed += n
+        if cursor is None or time.time() > deadline:
+            return {'changed': changed, 'cursor': cursor}
+
 #--------------------------------------------------------------------------------------------------
 @get('/login')
 def login():
@@ -88,7 +154,7 @@ def index():
 @get('/posts/new', name="new_post_path")
 @login_required
 def post_new():
-    context = {'post': Post(), 'categories' : Category.all().fetch(limit=None)}
+    context = {'post': Post(), 'body': PostBody(), 'categories' : Category.cached()}
     return template('post_edit.html', **context)
 
     
@@ -97,11 +163,10 @@ def post_new():
 def post_create():
     p = Post()
     p.title = request.params.title
-    p.slug = slugify(p.title)
+    p.do_slug(slugify(p.title))
     #p.do_tags(request.params.tags)
     p.do_category(request.params.category)
-    p.body = request.params.body
-    p.body_html = markdown.markdown(p.body)
+    body = request.params.body
     if request.params['submit'] == 'post':
         p.published = True
         p.published_at = datetime.now()
@@ -110,14 +175,17 @@ def post_create():
         p.published = False
       
   
-    p.put()
+    p.put_with_body(body, *render_markdown(body))
+    if not p.published: CounterShard.add('drafts', 1)
     redirect("/")
   
 @get('/posts/<year:re:\d{4}>/<month:re:\d{2}>/<day:re:\d{2}>/<slug>', name = "post_path")  
 def post_show(year, month, day, slug):
     q = Post.all();                
     q.filter("slug = ", slug)        
-    context = {'post': q.get()}
+    post = q.get()
+    if not post: abort(404, 'No such post')
+    context = {'post': post, 'body': post.get_body()}
     return template('post_show.html', **context)
  
 
@@ -125,7 +193,10 @@ def post_show(year, month, day, slug):
 @login_required  
 def post_destroy(id):
     p = Post.get_by_id(long(id))
-    if p: p.delete()  
+    if p:
+        p.delete_with_body()
+        Slug.release(p.slug)
+        if not p.published: CounterShard.add('drafts', -1)
     redirect("/")  
 
 
@@ -134,7 +205,7 @@ def post_destroy(id):
 @login_required
 def post_edit(id):
     post = Post.get_by_id(long(id))    
-    context = {'post': post, 'categories' : Category.all().fetch(limit=None)}
+    context = {'post': post, 'body': post.get_body(), 'categories' : Category.cached()}
     return template('post_edit.html', **context)  
 
 
@@ -143,12 +214,12 @@ def post_edit(id):
 def post_update(id):
     #logging.info("category param is %s", request.params['category'])
     p = Post.get_by_id(long(id))    
+    counted, was_draft = p.counted_category(), not p.published
     p.title = request.params.title
-    p.slug = slugify(p.title)
+    p.do_slug(slugify(p.title))
     #p.do_tags(request.params.tags)
     p.do_category(request.params.category)
-    p.body = request.params.body
-    p.body_html = markdown.markdown(p.body)
+    body = request.params.body
     p.last_updated_by = users.get_current_user().email()
     if request.params['submit'] == 'post':
         p.published = True
@@ -157,27 +228,41 @@ def post_update(id):
         p.published = False
         
   
-    p.put()
+    p.put_with_body(body, *render_markdown(body), counted=counted)
+    CounterShard.add('drafts', (not p.published) - was_draft)
     redirect("/")         
     
 
 @get('/posts/draft', name = "draft_posts_path")
 @login_required
 def draft_posts():
-    posts = Post.all().filter('published =', False).order("-updated_at").fetch(limit=None)
-    return template('post_by.html', posts=posts) 
+    current_page = int(request.query.page) if request.query.page else 1
+    q = PagedQuery(Post.drafts(), 20)
+    result = q.fetch_page(current_page)
+    count = CounterShard.get_count('drafts', Post.count_drafts)
+    has_next = q.has_page(current_page + 1)
+    has_prev = current_page > 1
+    category_names = dict((c.key(), c.name) for c in Category.cached())
+    return template('drafts.html', posts=result, count=count, category_names=category_names, page = current_page, has_next = has_next, has_prev = has_prev) 
 
 #--------------------------------------------------------------------------------------------------
-# @get('/categories.json')
+# @get('/categories.json', json=True)
 # def categories():
 #     categories = Category.all().fetch(limit=None)
 #     return [category.name for category in categories]
 
-@get('/posts/category/<category_id>', name = "category_posts_path")
+@get('/posts/category/<category_id:path>', name = "category_posts_path")
 def categorified_post(category_id):
     #logging.info("category name is %s", category_name)
-    c = Category.get_by_id(long(category_id)) 
-    return template('post_by.html', posts=c.posts) 
+    c = Category.get_by_url_id(category_id)
+    if not c: abort(404, 'No such category')
+    if c.post_count is None: c.count_posts()
+    current_page = int(request.query.page) if request.query.page else 1
+    q = PagedQuery(c.published_posts(), 5)
+    result = q.order('-published_at').fetch_page(current_page)
+    has_next = current_page * q.page_size < c.post_count
+    has_prev = current_page > 1
+    return template('post_by.html', posts=result, category=c, page = current_page, has_next = has_next, has_prev = has_prev) 
     
     
     
@@ -4,15 +4,268 @@
 model class 
 '''
 from google.appengine.ext import db
+from google.appengine.api import datastore, datastore_errors, memcache
 from datetime import datetime
 import re
+import time
+import random
+import urllib
 import logging
 
+# transactions that write a post and the categories it is counted in
+XG = db.create_transaction_options(xg=True)
 
 
 class Category(db.Model):
     name            = db.StringProperty()
     created_at      = db.DateTimeProperty(auto_now_add=True)
+    post_count      = db.IntegerProperty()  # published posts, None until counted
+    post_moves      = db.IntegerProperty(default=0)  # move_post calls, see count_posts
+
+    # all categories, kept in memcache and for a short while in process
+    _cached = None
+    _cached_until = 0
+    CACHE_KEY = 'categories'
+    CACHE_SECONDS = 60
+
+    KEY_PREFIX = 'category:'
+
+    @classmethod
+    def key_name_for(cls, name):
+        # one category per name, whatever its case and spacing
+        return cls.KEY_PREFIX + u' '.join(name.lower().split())
+
+    @property
+    def url_id(self):
+        # the id of categories from before they were keyed by name, else the
+        # quoted key name without its prefix
+        key = self.key()
+        if key.id():
+            return key.id()
+        return urllib.quote(key.name()[len(self.KEY_PREFIX):].encode('utf-8'), safe='')
+
+    @classmethod
+    def get_by_url_id(cls, category_id):
+        """
+        Return the category of a category_posts_path url (see url_id). The
+        server has unquoted it already
+        """
+        try:
+            name = category_id.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+        category = cls.get_by_key_name(cls.key_name_for(name))
+        if not category and category_id.isdigit():
+            category = cls.get_by_id(long(category_id))
+        return category
+
+    @classmethod
+    def cached(cls):
+        """
+        Return all categories, from the cache if possible
+        """
+        if cls._cached is None or cls._cached_until < time.time():
+            categories = memcache.get(cls.CACHE_KEY)
+            if categories is None:
+                categories = cls.all().fetch(limit=None)
+                # expires in case the query missed a category just created
+                memcache.set(cls.CACHE_KEY, categories, 3600)
+            cls._cached = categories
+            cls._cached_until = time.time() + cls.CACHE_SECONDS
+        return cls._cached
+
+    @classmethod
+    def flush_cache(cls):
+        memcache.delete(cls.CACHE_KEY)
+        cls._cached = None
+
+    @classmethod
+    def get_or_create(cls, name):
+        """
+        Return the category called name, creating it in a transaction if
+        there is none yet
+        """
+        key_name = cls.key_name_for(name)
+        for category in cls.cached():
+            if cls.key_name_for(category.name or u'') == key_name:
+                return category
+
+        def txn():
+            category = cls.get_by_key_name(key_name)
+            if category:
+                return category, False
+            category = cls(key_name=key_name, name=name, post_count=0)
+            category.put()
+            return category, True
+
+        category, created = db.run_in_transaction(txn)
+        if created:
+            cls.flush_cache()
+        return category
+
+    @classmethod
+    def move_post(cls, old, new):
+        """
+        Move a published post from the count of category key old to that of
+        category key new, either of which can be None. Call it in the
+        transaction that writes the post, so the counts can not miss a write
+        """
+        if old == new:
+            return
+
+        for key, delta in ((old, -1), (new, 1)):
+            if key:
+                category = cls.get(key)
+                if category:
+                    category.post_moves = (category.post_moves or 0) + 1
+                    if category.post_count is not None:
+                        category.post_count += delta
+                    category.put()
+        cls.flush_cache()
+
+    def published_posts(self):
+        return Post.all().filter('category =', self).filter('published =', True)
+
+    def count_posts(self):
+        """
+        Count the published posts of a category from before post_count was
+        kept, it is maintained by move_post from then on. The count query
+        can not run in the transaction, so a post moved while counting
+        shows in post_moves and the posts are counted again
+        """
+        def txn(moves, count):
+            category = Category.get(self.key())
+            if category.post_count is None:
+                if category.post_moves != moves:
+                    return None
+                category.post_count = count
+                category.put()
+            return category.post_count
+
+        post_count = None
+        while post_count is None:
+            moves = Category.get(self.key()).post_moves
+            count = Post.all(keys_only=True).filter('category =', self)\
+                        .filter('published =', True).count(limit=None)
+            post_count = db.run_in_transaction(txn, moves, count)
+
+        self.post_count = post_count
+        self.flush_cache()
+
+
+class CounterShard(db.Model):
+    """
+    One of the shards of a counter, writes go to a random shard so that they
+    do not all contend for the same entity
+    """
+    name            = db.StringProperty()
+    count           = db.IntegerProperty(default=0)
+
+    SHARDS = 10
+
+    @staticmethod
+    def key_name_for(name, index):
+        return 'counter:%s:%d' % (name, index)
+
+    @classmethod
+    def add(cls, name, delta):
+        """
+        Add delta to the counter name, once it is started by get_count
+        """
+        if not delta or not cls.get_by_key_name(cls.key_name_for(name, 0)):
+            return
+
+        def txn(key_name):
+            shard = cls.get_by_key_name(key_name)
+            if shard is None:
+                shard = cls(key_name=key_name, name=name)
+            shard.count += delta
+            shard.put()
+
+        db.run_in_transaction(txn, cls.key_name_for(name, random.randrange(cls.SHARDS)))
+        memcache.delete('counter:' + name)
+
+    @classmethod
+    def get_count(cls, name, initial):
+        """
+        Return the value of the counter name, the first time it is started
+        with the value initial() returns
+        """
+        count = memcache.get('counter:' + name)
+        if count is None:
+            shards = cls.get_by_key_name([cls.key_name_for(name, i) for i in range(cls.SHARDS)])
+            if shards[0] is None:
+                shards[0] = cls.get_or_insert(cls.key_name_for(name, 0), name=name, count=initial())
+            count = sum(shard.count for shard in shards if shard)
+            memcache.set('counter:' + name, count, 60)
+        return count
+
+
+class Slug(db.Model):
+    """
+    Claims a post slug, see key_name_for
+    """
+    base            = db.StringProperty()  # the slug was claimed for
+    created_at      = db.DateTimeProperty(auto_now_add=True)
+
+    @staticmethod
+    def key_name_for(slug):
+        # key names may not start with a digit, slugs may
+        return 'slug:' + slug
+
+    @classmethod
+    def claim(cls, base):
+        """
+        Return the first free slug of base, base-2, base-3, ... and claim it.
+        Each name is checked and claimed in one transaction, so two posts
+        saved at the same time never get the same slug.
+        """
+        name, n = base, 1
+        while not db.run_in_transaction(cls._claim, name, base):
+            n += 1
+            name = "%s-%d" % (base, n)
+        return name
+
+    @classmethod
+    def _claim(cls, name, base):
+        if cls.get_by_key_name(cls.key_name_for(name)):
+            return False
+        cls(key_name=cls.key_name_for(name), base=base).put()
+        return True
+
+    @classmethod
+    def backfill(cls, cursor=None, batch=50):
+        """
+        Claim the slugs of up to batch posts saved before the Slug index.
+        Return the number of slugs claimed and the cursor to go on from,
+        None after the last post
+        """
+        q = db.Query(Post, projection=('slug',))
+        if cursor:
+            q.with_cursor(cursor)
+        posts = q.fetch(batch)
+        claimed = len([post for post in posts if post.slug and
+                       db.run_in_transaction(cls._claim, post.slug, post.slug)])
+        return claimed, (q.cursor() if len(posts) == batch else None)
+
+    @classmethod
+    def release(cls, name):
+        if name:
+            db.delete(db.Key.from_path(cls.kind(), cls.key_name_for(name)))
+
+
+class PostBody(db.Model):
+    """
+    The text of a post, kept apart from the Post so that listings do not
+    fetch it. Its parent is the Post and its key name is 'body'
+    """
+    body            = db.TextProperty()
+    body_html       = db.TextProperty()
+    toc_html        = db.TextProperty()  # table of contents of body_html
+
+    @staticmethod
+    def key_for(post):
+        return db.Key.from_path('PostBody', 'body', parent=post.key())
 
 
 class Post(db.Model):
@@ -20,8 +273,11 @@ class Post(db.Model):
     last_updated_by = db.EmailProperty()
     title           = db.StringProperty()
     slug            = db.StringProperty()
+    summary_html    = db.TextProperty()  # first paragraph of body_html
+    # moved to PostBody, only set on posts saved before it (see migrate_bodies)
     body            = db.TextProperty()
     body_html       = db.TextProperty()
+    toc_html        = db.TextProperty()
     published       = db.BooleanProperty()
     published_at    = db.DateTimeProperty()
     created_at      = db.DateTimeProperty(auto_now_add=True)
@@ -30,19 +286,116 @@ class Post(db.Model):
     # tags            = db.StringListProperty(default=[]) 
     category        = db.ReferenceProperty(Category, collection_name='posts')
 
+    _slug_change = None  # (old, new) slug from do_slug until the post is put
+
     #ptag_regex = re.compile("<p>.*?<\/p>", re.DOTALL)
      
+    # columns of the drafts listing, fetched without the text properties
+    DRAFT_COLUMNS = ('title', 'slug', 'updated_at', 'category')
+
+    @classmethod
+    def drafts(cls):
+        return db.Query(cls, projection=cls.DRAFT_COLUMNS)\
+                 .filter('published =', False).order('-updated_at')
+
+    @classmethod
+    def count_drafts(cls):
+        return cls.all(keys_only=True).filter('published =', False).count(limit=None)
+
     @property
     def url(self):
         return "/posts/%s/%s" % (self.published_at.strftime("%Y/%m/%d"), self.slug)
         
     @property    
     def summary(self):        
-        pos = self.body_html.find("</p>")
+        if self.summary_html is not None:
+            return self.summary_html
+        return self.summarize(self.body_html or u'')
+
+    @staticmethod
+    def summarize(body_html):
+        pos = body_html.find("</p>")
         if pos == -1:
-            return self.body_html
+            return body_html
         else:
-            return self.body_html[:pos+4]
+            return body_html[:pos+4]
+
+    def get_body(self):
+        """
+        Fetch the PostBody of the post
+        """
+        body = None
+        if self.is_saved():
+            body = PostBody.get(PostBody.key_for(self))
+        if body is None: # a new post, or one not migrated yet
+            body = PostBody(body=self.body, body_html=self.body_html, toc_html=self.toc_html)
+        return body
+
+    def put_with_body(self, body, body_html, toc_html, counted=None):
+        """
+        Put the post and its PostBody in one transaction, which also moves
+        the post from the post_count of the category counted, what
+        counted_category() was before the changes, to its new category
+        """
+        def txn():
+            self._put_with_body(body, body_html, toc_html)
+            Category.move_post(counted, self.counted_category())
+
+        old, new = self._slug_change or (None, None)
+        self._slug_change = None
+        try:
+            db.run_in_transaction_options(XG, txn)
+        except Exception:
+            if new: # the post still has its old slug
+                Slug.release(new)
+                self.slug = old
+            raise
+        Slug.release(old)
+
+    def _put_with_body(self, body, body_html, toc_html):
+        self.summary_html = self.summarize(body_html or u'')
+        self.body = self.body_html = self.toc_html = None
+        self.put()
+        PostBody(parent=self, key_name='body', body=body, body_html=body_html,
+                 toc_html=toc_html).put()
+
+    def delete_with_body(self):
+        def txn():
+            db.delete([self.key(), PostBody.key_for(self)])
+            Category.move_post(self.counted_category(), None)
+        db.run_in_transaction_options(XG, txn)
+
+    @classmethod
+    def migrate_bodies(cls, cursor=None, batch=20):
+        """
+        Move the text of up to batch posts saved before PostBody into their
+        PostBody, keeping their updated_at. Return the number of posts moved
+        and the cursor to go on from, None after the last post
+        """
+        q = cls.all(keys_only=True)
+        if cursor:
+            q.with_cursor(cursor)
+        keys = q.fetch(batch)
+
+        def txn(key):
+            # the entity, not the model: putting it leaves updated_at alone
+            try:
+                entity = datastore.Get(key)
+            except datastore_errors.EntityNotFoundError:
+                return False
+            if entity.get('body') is None and entity.get('body_html') is None:
+                return False
+            PostBody(parent=key, key_name='body', body=entity.get('body'),
+                     body_html=entity.get('body_html'), toc_html=entity.get('toc_html')).put()
+            entity['summary_html'] = db.Text(cls.summarize(entity.get('body_html') or u''))
+            for name in ('body', 'body_html', 'toc_html'):
+                if name in entity:
+                    del entity[name]
+            datastore.Put(entity)
+            return True
+
+        moved = len([key for key in keys if db.run_in_transaction(txn, key)])
+        return moved, (q.cursor() if len(keys) == batch else None)
 
     # def do_tags(self, raw_tags):
     #     if raw_tags:            
@@ -51,13 +404,37 @@ class Post(db.Model):
     #             tag = Tag(key_name = tag_name) 
     #             tag.put()  
                 
+    def do_slug(self, base):
+        """
+        Give the post a unique slug for base, keeping the current one if it
+        is base or was claimed for base
+        """
+        base = base or 'post'
+        if self.slug and re.match(r'%s(-\d+)?$' % re.escape(base), self.slug):
+            # posts from before the Slug index get their Slug here
+            slug = Slug.get_or_insert(Slug.key_name_for(self.slug), base=self.slug)
+            if self.slug == base or slug.base == base:
+                return
+        # put_with_body releases the old slug once the post is written
+        self._slug_change = (self.slug, Slug.claim(base))
+        self.slug = self._slug_change[1]
+
+    @property
+    def category_key(self):
+        # without fetching the category
+        return Post.category.get_value_for_datastore(self)
+
+    def counted_category(self):
+        """
+        Key of the category whose post_count includes this post, if any
+        """
+        if self.published:
+            return self.category_key
+        return None
+
     def do_category(self, cat_name):
-        if cat_name:
-            category = Category.all().filter('name = ', cat_name).get()
-            if not category:
-                   category = Category(name = cat_name)          
-                   category.put()
-            self.category = category
+        if cat_name and cat_name.strip():
+            self.category = Category.get_or_create(cat_name.strip())
         else:
             self.category = None    
 
@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Measure the per-request overhead of bottle on a hello-world route.
+
+    The WSGI application is called directly, without a server, so the numbers
+    only include what bottle itself does for a request: binding the request
+    and response, routing, converting the result and building the headers.
+
+    With --servers the same routes are served by each of the named server
+    adapters instead, and a number of concurrent keep-alive clients measure
+    the throughput of the whole stack.
+
+    Named targets compare an optimized part of the libraries with the code it
+    replaced on a fixed corpus: they report every input on which the two give
+    different results, and the time each of them took.
+
+    Usage: python bench.py [-n REQUESTS] [-r REPEAT]
+           python bench.py --servers wsgiref,threadpool [-c CLIENTS] [-n REQUESTS]
+           python bench.py [-r REPEAT] TARGET...    (targets: see --help)
+"""
+
+import sys, os, time, socket, subprocess, threading, httplib, random
+package_dir = "lib"
+package_dir_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), package_dir)
+sys.path.insert(0, package_dir_path)
+
+import bottle
+
+app = bottle.Bottle()
+
+@app.route('/')
+def hello():
+    return 'Hello World'
+
+@app.route('/headers')
+def hello_headers():
+    bottle.response.content_type = 'text/plain'
+    bottle.response.set_header('Cache-Control', 'no-cache')
+    return 'Hello World'
+
+def start_response(status, headerlist):
+    pass
+
+def bench(path, requests, repeat):
+    ''' Return the best time per request in microseconds. '''
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '',
+               'wsgi.errors': sys.stderr}
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        for j in xrange(requests):
+            app(environ.copy(), start_response)
+        took = time.time() - start
+        if best is None or took < best: best = took
+    return best / requests * 1e6
+
+def serve(server, port):
+    bottle.run(app, server=server, port=port, quiet=True)
+
+def throughput(server, path, clients, requests, port=8765):
+    ''' Return the requests per second served by `server` to `clients`
+        concurrent connections, each sending `requests` requests. '''
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                             '--serve', server, '--port', str(port)])
+    try:
+        for i in xrange(100):
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                break
+            except socket.error:
+                time.sleep(0.05)
+        errors = []
+        def client():
+            conn = httplib.HTTPConnection('127.0.0.1', port)
+            try:
+                for i in xrange(requests):
+                    conn.request('GET', path)
+                    conn.getresponse().read()
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=client) for i in xrange(clients)]
+        start = time.time()
+        for t in threads: t.start()
+        for t in threads: t.join()
+        took = time.time() - start
+        if errors:
+            raise errors[0]
+        return clients * requests / took
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def compare(new, old, corpus, repeat):
+    ''' Run `new` and `old` on every input of `corpus` and print the inputs
+        on which they differ and the best time of each. An input on which
+        `old` raises only counts as a difference if `new` raises as well.
+        Return the number of differences. '''
+    def run(func, data):
+        try:
+            return func(data)
+        except Exception, e:
+            return e.__class__
+    differ = raised = 0
+    for data in corpus:
+        a, b = run(new, data), run(old, data)
+        if isinstance(b, type) and not isinstance(a, type):
+            raised += 1
+        elif a != b:
+            differ += 1
+            print '  differs: %r...' % (data[:60],)
+    print '  %d inputs, %d differ, the old code raised on %d' % (len(corpus), differ, raised)
+    for name, func in (('new', new), ('old', old)):
+        best = None
+        for i in xrange(repeat):
+            start = time.time()
+            for data in corpus: run(func, data)
+            took = time.time() - start
+            if best is None or took < best: best = took
+        print '  %-4s %10.2f ms' % (name, best * 1e3)
+    return differ
+
+def converter(md):
+    ''' Return a function converting one document with markdown instance md. '''
+    def convert(text):
+        md.reset()
+        return md.convert(text)
+    return convert
+
+def html_corpus(seed=26):
+    ''' Markdown documents mixing random nested, unclosed and interleaved
+        html blocks, plus deeply nested and never closed ones. '''
+    rnd = random.Random(seed)
+    tags = ['div', 'table', 'p', 'pre', 'blockquote', 'ul', 'span']
+    def element(depth):
+        tag = rnd.choice(tags)
+        parts = ['<%s%s>' % (tag, rnd.choice(['', ' class="x"', ' title="a > b"']))]
+        for i in xrange(rnd.randint(0, 3)):
+            if depth and rnd.random() < 0.6:
+                parts.append(element(depth - 1))
+            else:
+                parts.append(rnd.choice(['text', '*em*', '\n\n', '\n', '<br />', '<!-- c -->']))
+        if rnd.random() < 0.9: # leave some of them open
+            parts.append('</%s>' % tag)
+        return ''.join(parts)
+    corpus = []
+    for i in xrange(400):
+        blocks = []
+        for j in xrange(rnd.randint(1, 8)):
+            if rnd.random() < 0.4:
+                blocks.append(rnd.choice(['Some *text*.', '# Title', '    code', '* item']))
+            else:
+                blocks.append(element(rnd.randint(0, 6)))
+        corpus.append('\n\n'.join(blocks))
+    for n in (10, 100, 400):
+        corpus.append('<div>' * n + 'x' + '</div>' * n)
+    rows = ''.join('<tr><td>%d</td></tr>\n' % i for i in xrange(300))
+    corpus.append('<table>\n' + rows + '</table>\n\n' + rows)
+    corpus.append('<div>' * 2000 + 'never closed')
+    return corpus
+
+def bench_html_blocks(opt):
+    ''' html block matching of markdown's HtmlBlockPreprocessor against the
+        recursive matching it used before '''
+    import markdown
+    class RecursiveHtmlBlock(markdown.preprocessors.HtmlBlockPreprocessor):
+        def _nested_tagfind(self, ltag, rtag, start_index, block):
+            while 1:
+                i = block.find(rtag, start_index)
+                if i == -1:
+                    return -1
+                j = block.find(ltag, start_index)
+                if (j > i or j == -1):
+                    return i + len(rtag)
+                j = block.find('>', j)
+                start_index = self._nested_tagfind(ltag, rtag, j + 1, block)
+                if start_index == -1:
+                    return -1
+    new, old = markdown.Markdown(), markdown.Markdown()
+    old.preprocessors['html_block'] = RecursiveHtmlBlock(old)
+    return compare(converter(new), converter(old), html_corpus(), opt.repeat)
+
+def fenced_corpus(seed=42):
+    ''' Markdown documents with fenced code blocks: languages, fences of
+        different lengths inside each other, unclosed fences and one document
+        with 500 blocks. '''
+    rnd = random.Random(seed)
+    def block():
+        fence = '~' * rnd.randint(3, 5)
+        lang = rnd.choice(['', '.python', '{.js}', '{.c-sharp}', ' .sh', '{.}'])
+        lines = [rnd.choice(['x = 1', '<b>&"</b>', '~~~', '  indented', '', '~~~~~~']) for i in xrange(rnd.randint(0, 5))]
+        close = fence + rnd.choice(['', '  ', '~']) if rnd.random() < 0.9 else ''
+        return '\n'.join([fence + rnd.choice(['', ' ']) + lang] + lines + [close])
+    corpus = []
+    for i in xrange(400):
+        parts = [rnd.choice([block, lambda: 'Some *text*.', lambda: '    code', lambda: '# Title'])()
+                 for j in xrange(rnd.randint(1, 8))]
+        corpus.append(rnd.choice(['\n\n', '\n']).join(parts))
+    corpus.append('\n\n'.join('Part %d\n\n~~~.python\nprint %d\n~~~' % (i, i) for i in xrange(500)))
+    return corpus
+
+def bench_fenced_code(opt):
+    ''' fenced code extraction of the fenced_code extension against the
+        search and rebuild loop it used before '''
+    import markdown
+    from markdown.extensions import fenced_code
+    class RebuildingFencedBlock(fenced_code.FencedBlockPreprocessor):
+        def run(self, lines):
+            text = "\n".join(lines)
+            while 1:
+                m = fenced_code.FENCED_BLOCK_RE.search(text)
+                if m:
+                    lang = ''
+                    if m.group('lang'):
+                        lang = fenced_code.LANG_TAG % m.group('lang')
+                    code = fenced_code.CODE_WRAP % (lang, self._escape(m.group('code')))
+                    placeholder = self.markdown.htmlStash.store(code, safe=True)
+                    text = '%s\n%s\n%s'% (text[:m.start()], placeholder, text[m.end():])
+                else:
+                    break
+            return text.split("\n")
+    new = markdown.Markdown(extensions=['fenced_code'])
+    old = markdown.Markdown(extensions=['fenced_code'])
+    old.preprocessors['fenced_code_block'] = RebuildingFencedBlock(old)
+    return compare(converter(new), converter(old), fenced_corpus(), opt.repeat)
+
+def unidecode_corpus(seed=45):
+    ''' Titles and random strings mixing ASCII with characters from all
+        over the BMP, the Private Use Area and above, plus byte strings. '''
+    rnd = random.Random(seed)
+    corpus = [u'', u'How to write a fast web app in Python', u'Notes on Caf\xe9 culture in Z\xfcrich',
+              u'\u5317\u4eac travel log', u'\u041c\u043e\u0441\u043a\u0432\u0430',
+              u'emoji \U0001F600 and \U000F0000 private', u'\x00\x01\x7f control',
+              'byte string', 'caf\xe9 latin-1 bytes \xff']
+    codepoints = range(0x80, 0x3000) + range(0x3000, 0x10000, 7) + [0xeffff, 0xf0000, 0x10ffff, 0x1d400]
+    for i in xrange(3000):
+        parts = []
+        for j in xrange(rnd.randint(1, 12)):
+            if rnd.random() < 0.5:
+                parts.append(rnd.choice(['word ', 'Title-', '123', ' ', '\t', 'x']))
+            else:
+                parts.append(u''.join(unichr(rnd.choice(codepoints)) for k in xrange(rnd.randint(1, 6))))
+        corpus.append(u''.join(parts))
+    return corpus
+
+def bench_unidecode(opt):
+    ''' unidecode against its old character by character loop '''
+    import unidecode
+    cache = {}
+    def old(string):
+        retval = []
+        for char in string:
+            codepoint = ord(char)
+            if codepoint < 0x80:
+                retval.append(str(char))
+                continue
+            if codepoint > 0xeffff:
+                continue
+            section = codepoint >> 8
+            position = codepoint % 256
+            try:
+                table = cache[section]
+            except KeyError:
+                try:
+                    mod = __import__('unidecode.x%03x'%(section), [], [], ['data'])
+                except ImportError:
+                    cache[section] = None
+                    continue
+                cache[section] = table = mod.data
+            if table and len(table) > position:
+                retval.append( table[position] )
+        return ''.join(retval)
+    def typed(func): # u'a' == 'a', the type has to match as well
+        def typed(string):
+            result = func(string)
+            return type(result), result
+        return typed
+    titles = [u'How to write a fast web app in Python'] * 60 + \
+             [u'Notes on Caf\xe9 culture in Z\xfcrich', u'\u5317\u4eac travel log',
+              u'\u041c\u043e\u0441\u043a\u0432\u0430 \u2014 \u0441\u0442\u043e\u043b\u0438\u0446\u0430 \u0420\u043e\u0441\u0441\u0438\u0438',
+              u'A long mostly ASCII paragraph ' * 20 + u'with one caf\xe9'] * 10
+    print ' titles, mostly ASCII'
+    differ = compare(typed(unidecode.unidecode), typed(old), titles, opt.repeat)
+    print ' random strings'
+    return differ + compare(typed(unidecode.unidecode), typed(old), unidecode_corpus(), opt.repeat)
+
+def article(rnd, paragraphs):
+    ''' A markdown article with headers, lists and code. '''
+    words = 'the post body is fetched only when a single post is shown'.split()
+    parts = []
+    for i in xrange(paragraphs):
+        if i % 5 == 0:
+            parts.append('## Section %d' % i)
+        kind = rnd.random()
+        if kind < 0.2:
+            parts.append('\n'.join('* ' + ' '.join(rnd.sample(words, 5)) for j in xrange(4)))
+        elif kind < 0.3:
+            parts.append('\n'.join('    code_line(%d)' % j for j in xrange(8)))
+        else:
+            parts.append(' '.join(rnd.choice(words) for j in xrange(rnd.randint(40, 90))))
+    return '\n\n'.join(parts)
+
+def bench_listing(opt):
+    ''' bytes a 5 post listing page reads with the post text on the Post and
+        with the text in PostBody (entity size and decode time need the App
+        Engine SDK) '''
+    import markdown
+    rnd = random.Random(50)
+    try:
+        from google.appengine.ext import db
+        os.environ.setdefault('APPLICATION_ID', 'bench')
+        from app.models import Post
+    except ImportError:
+        db = None
+    print '  %-22s %12s %12s %14s %14s' % ('page of 5 posts', 'text before', 'text after',
+                                            'entity before', 'entity after')
+    for name, paragraphs in (('short (3 paragraphs)', 3), ('medium (15)', 15), ('long (60)', 60)):
+        posts = []
+        for i in xrange(5):
+            md = markdown.Markdown(extensions=['toc'])
+            body = article(rnd, paragraphs).decode('ascii')
+            body_html = md.convert(body)
+            pos = body_html.find('</p>')
+            posts.append((body, body_html, md.toc, body_html if pos == -1 else body_html[:pos + 4]))
+        text = lambda *values: sum(len(v.encode('utf-8')) for v in values)
+        before = sum(text(body, html, toc) for body, html, toc, summary in posts)
+        after = sum(text(summary) for body, html, toc, summary in posts)
+        entities = ''
+        if db:
+            sizes, times = [], []
+            for moved in (False, True):
+                page = []
+                for body, html, toc, summary in posts:
+                    post = Post(title=u'A post title', slug=u'a-post-title', published=True)
+                    if moved:
+                        post.summary_html = summary
+                    else:
+                        post.body, post.body_html, post.toc_html = body, html, toc
+                    page.append(db.model_to_protobuf(post).Encode())
+                best = None
+                for i in xrange(opt.repeat):
+                    start = time.time()
+                    for data in page: db.model_from_protobuf(data)
+                    took = time.time() - start
+                    if best is None or took < best: best = took
+                sizes.append(sum(len(data) for data in page))
+                times.append(best)
+            entities = '%7d %6.2fms %7d %6.2fms' % (sizes[0], times[0] * 1e3, sizes[1], times[1] * 1e3)
+        print '  %-22s %12d %12d %s' % (name, before, after, entities)
+    if not db:
+        print '  entity size and decode time: the App Engine SDK is not on the path'
+    return 0
+
+TARGETS = {'html_blocks': bench_html_blocks, 'fenced_code': bench_fenced_code,
+           'unidecode': bench_unidecode, 'listing': bench_listing}
+
+if __name__ == '__main__':
+    import optparse
+    parser = optparse.OptionParser(usage="usage: %prog [options] [TARGET...]",
+        epilog="targets: " + "; ".join("%s: %s" % (name, ' '.join(func.__doc__.split()))
+                                      for name, func in sorted(TARGETS.items())))
+    parser.add_option("-n", "--requests", type="int", default=20000,
+                      help="requests per round (default: 20000)")
+    parser.add_option("-r", "--repeat", type="int", default=10,
+                      help="rounds, the best one is reported (default: 10)")
+    parser.add_option("-s", "--servers", default=None,
+                      help="comma separated server adapters to measure")
+    parser.add_option("-c", "--clients", type="int", default=8,
+                      help="concurrent clients per server (default: 8)")
+    parser.add_option("--serve", default=None, help=optparse.SUPPRESS_HELP)
+    parser.add_option("--port", type="int", default=8765,
+                      help="port for the servers (default: 8765)")
+    opt, args = parser.parse_args()
+    for name in args:
+        if name not in TARGETS: parser.error('unknown target %r' % name)
+    if args:
+        differ = 0
+        for name in args:
+            print name
+            differ += TARGETS[name](opt)
+        sys.exit(differ and 1)
+    elif opt.serve:
+        serve(opt.serve, opt.port)
+    elif opt.servers:
+        requests = opt.requests // opt.clients // 10 or 1
+        for server in opt.servers.split(','):
+            for path in ('/', '/headers'):
+                rps = throughput(server, path, opt.clients, requests, opt.port)
+                print '%-12s %-10s %8.0f requests/s' % (server, path, rps)
+    else:
+        for path in ('/', '/headers'):
+            print '%-10s %8.2f us/request' % (path, bench(path, opt.requests, opt.repeat))
@@ -39,6 +39,7 @@ import sys
 import base64
 import cgi
 import email.utils
+import errno
 import functools
 import hmac
 import httplib
@@ -47,6 +48,7 @@ import itertools
 import mimetypes
 import os
 import re
+import socket
 import subprocess
 import tempfile
 import thread
@@ -89,7 +91,6 @@ except ImportError: # pragma: no cover
             json_lds = json_dumps
 
 py3k = sys.version_info >= (3,0,0)
-NCTextIOWrapper = None
 
 if sys.version_info < (2,6,0):
     msg = "Python 2.5 support may be dropped in future versions of Bottle."
@@ -102,12 +103,6 @@ if py3k: # pragma: no cover
     def touni(x, enc='utf8', err='strict'):
         """ Convert anything to unicode """
         return str(x, enc, err) if isinstance(x, bytes) else str(x)
-    if sys.version_info < (3,2,0):
-        from io import TextIOWrapper
-        class NCTextIOWrapper(TextIOWrapper):
-            ''' Garbage collecting an io.TextIOWrapper(buffer) instance closes
-                the wrapped buffer. This subclass keeps it open. '''
-            def close(self): pass
 else:
     json_loads = json_lds
     from StringIO import StringIO as BytesIO
@@ -626,6 +621,17 @@ class Bottle(object):
             for route in routes: route.prepare()
         self.hooks.trigger('app_reset')
 
+    def prepare_all(self, templates=(), **options):
+        ''' Do all on-demand work immediately, e.g. from a warmup request
+            before real traffic arrives: Apply the plugins to every route and
+            load and compile the named templates. Keyword arguments are the
+            ``template_*`` options accepted by :func:`template`. Routes are
+            compiled into the router as soon as they are added, so there is
+            nothing left to do for the router. Mounted applications have to
+            be prepared separately. '''
+        for route in self.routes: route.prepare()
+        for name in templates: load_template(name, **options)
+
     def close(self):
         ''' Close the application and all installed plugins. '''
         for plugin in self.plugins:
@@ -827,7 +833,7 @@ class Bottle(object):
             or request.method == 'HEAD':
                 if hasattr(out, 'close'): out.close()
                 out = []
-            start_response(response._status_line, list(response.iter_headers()))
+            start_response(response._status_line, response.headerlist)
             return out
         except (KeyboardInterrupt, SystemExit, MemoryError):
             raise
@@ -866,6 +872,10 @@ class BaseRequest(DictMixin):
     MEMFILE_MAX = 102400
     #: Maximum number pr GET or POST parameters per request
     MAX_PARAMS  = 100
+    #: Maximum size of a single (non-file) form field in bytes.
+    MAX_FIELD_SIZE = 1024 * 1024
+    #: Maximum size of a form encoded request body in bytes.
+    MAX_BODY_SIZE = 32 * 1024 * 1024
 
     def __init__(self, environ):
         """ Wrap a WSGI environ dictionary. """
@@ -940,32 +950,18 @@ class BaseRequest(DictMixin):
 
     @DictProperty('environ', 'bottle.request.params', read_only=True)
     def params(self):
-        """ A :class:`FormsDict` with the combined values of :attr:`query` and
-            :attr:`forms`. File uploads are stored in :attr:`files`. """
-        params = FormsDict()
-        for key, value in self.query.iterallitems():
-            params[key] = value
-        for key, value in self.forms.iterallitems():
-            params[key] = value
-        return params
+        """ A read-only :class:`FormsDict` with the combined values of
+            :attr:`query` and :attr:`forms`. Form values take precedence over
+            query values. Keys are looked up on demand, nothing is copied.
+            File uploads are stored in :attr:`files`. """
+        return ChainedFormsDict(self.query, self.forms)
 
     @DictProperty('environ', 'bottle.request.files', read_only=True)
     def files(self):
         """ File uploads parsed from an `url-encoded` or `multipart/form-data`
             encoded POST or PUT request body. The values are instances of
-            :class:`cgi.FieldStorage`. The most important attributes are:
-
-            filename
-                The filename, if specified; otherwise None; this is the client
-                side filename, *not* the file name on which it is stored (that's
-                a temporary file you don't deal with)
-            file
-                The file(-like) object from which you can read the data.
-            value
-                The value as a *string*; for file uploads, this transparently
-                reads the file every time you request the value. Do not do this
-                on big files.
-        """
+            :class:`FileUpload`, which has the same `filename`, `file` and
+            `value` attributes as :class:`cgi.FieldStorage`. """
         files = FormsDict()
         for name, item in self.POST.iterallitems():
             if hasattr(item, 'filename'):
@@ -1014,19 +1010,58 @@ class BaseRequest(DictMixin):
     def POST(self):
         """ The values of :attr:`forms` and :attr:`files` combined into a single
             :class:`FormsDict`. Values are either strings (form values) or
-            instances of :class:`cgi.FieldStorage` (file uploads).
+            instances of :class:`FileUpload` (file uploads).
+
+            The body is parsed while it is read from ``wsgi.input``, without
+            buffering it first. File uploads are spooled to temporary files
+            once they exceed :attr:`MEMFILE_MAX`. Bodies or fields larger than
+            :attr:`MAX_BODY_SIZE` or :attr:`MAX_FIELD_SIZE` are rejected with
+            a ``413`` error. A `multipart/form-data` body is not kept, so
+            :attr:`body` is empty after it has been parsed this way.
         """
+        error = self.environ.get('bottle.request.post.error')
+        if error: raise error
+        try:
+            return self._parse_post()
+        except HTTPError, e:
+            # The input is (partly) consumed, so fail the same way next time.
+            self.environ['bottle.request.post.error'] = e
+            raise
+
+    def _parse_post(self):
         post = FormsDict()
-        safe_env = {'QUERY_STRING':''} # Build a safe environment for cgi
-        for key in ('REQUEST_METHOD', 'CONTENT_TYPE', 'CONTENT_LENGTH'):
-            if key in self.environ: safe_env[key] = self.environ[key]
-        if NCTextIOWrapper:
-            fb = NCTextIOWrapper(self.body, encoding='ISO-8859-1', newline='\n')
+        ctype, options = cgi.parse_header(self.environ.get('CONTENT_TYPE', ''))
+        if not ctype.startswith('multipart/') and ctype not in \
+           ('', 'application/x-www-form-urlencoded'):
+            return post
+        if self.content_length > self.MAX_BODY_SIZE:
+            raise HTTPError(413, 'Request entity too large')
+        if 'bottle.request.body' in self.environ:
+            stream = self.body
         else:
-            fb = self.body
-        data = cgi.FieldStorage(fp=fb, environ=safe_env, keep_blank_values=True)
-        for item in (data.list or [])[:self.MAX_PARAMS]:
-            post[item.name] = item if item.filename else item.value
+            stream = self.environ['wsgi.input']
+        maxread = max(0, self.content_length)
+
+        if ctype.startswith('multipart/'):
+            boundary = options.get('boundary', '')
+            if not boundary: raise HTTPError(400, 'Missing multipart boundary')
+            self.environ['wsgi.input'] = BytesIO()
+            self.environ['bottle.request.body'] = self.environ['wsgi.input']
+            parts = _parse_multipart(stream, boundary, maxread,
+                                     self.MEMFILE_MAX, self.MAX_FIELD_SIZE,
+                                     self.MAX_PARAMS)
+            for item in parts:
+                post[item.name] = item if item.filename else item.value
+            return post
+
+        data = stream.read(maxread) if maxread else tob('')
+        self.environ['wsgi.input'] = BytesIO(data)
+        self.environ['bottle.request.body'] = self.environ['wsgi.input']
+        if py3k: data = touni(data, 'latin1')
+        for key, value in parse_qsl(data, keep_blank_values=True)[:self.MAX_PARAMS]:
+            if len(value) > self.MAX_FIELD_SIZE:
+                raise HTTPError(413, 'Form field too large')
+            post[key] = value
         return post
 
     @property
@@ -1174,8 +1209,85 @@ class BaseRequest(DictMixin):
     def __repr__(self):
         return '<%s: %s %s>' % (self.__class__.__name__, self.method, self.url)
 
+_hkeys = {}
+
 def _hkey(s):
-    return s.title().replace('_','-')
+    try:
+        return _hkeys[s]
+    except KeyError:
+        key = s.title().replace('_','-')
+        if len(_hkeys) < 1024: _hkeys[s] = key
+        return key
+
+def _iterlines(stream, maxread, bufsize=2**16):
+    """ Yield ``(line, newline)`` pairs read from a binary stream in chunks of
+        `bufsize`, up to `maxread` bytes. Lines longer than `bufsize` are
+        yielded in pieces with an empty `newline`. """
+    read, buf, lf, cr = stream.read, tob(''), tob('\n'), tob('\r')
+    while maxread > 0:
+        chunk = read(min(bufsize, maxread))
+        if not chunk: break
+        maxread -= len(chunk)
+        buf += chunk
+        start = 0
+        while True:
+            end = buf.find(lf, start)
+            if end < 0: break
+            if end > start and buf[end-1:end] == cr:
+                yield buf[start:end-1], buf[end-1:end+1]
+            else:
+                yield buf[start:end], lf
+            start = end + 1
+        buf = buf[start:]
+        if len(buf) > bufsize: # Keep a trailing \r, it may start a \r\n
+            yield buf[:-1], tob('')
+            buf = buf[-1:]
+    if buf:
+        yield buf, tob('')
+
+def _parse_multipart(stream, boundary, maxread, memfile_max, field_max,
+                     max_parts, bufsize=2**16):
+    """ Parse a `multipart/form-data` body from a stream in a single pass and
+        yield a :class:`FileUpload` per part. Plain fields are kept in memory
+        and limited to `field_max` bytes, file uploads are spooled to disk once
+        they exceed `memfile_max` bytes. Parts after the first `max_parts` are
+        read but discarded. """
+    separator = tob('--') + tob(boundary)
+    terminator = separator + tob('--')
+    bufsize = max(bufsize, len(terminator) + 2) # Never split a separator
+    part, headers, newline, size, count = None, None, tob(''), 0, 0
+    header, line_start = tob(''), True
+    for line, nl in _iterlines(stream, maxread, bufsize):
+        if line_start and line[:2] == tob('--') \
+           and line.rstrip() in (separator, terminator):
+            if part is not None:
+                part.file.seek(0)
+                if count < max_parts: yield part
+                count += 1
+            if line.rstrip() == terminator: return
+            part, headers, newline, size = None, [], tob(''), 0
+        elif headers is not None: # Header lines of the current part
+            header += line
+            if len(header) > field_max:
+                raise HTTPError(400, 'Multipart header too long')
+            elif not nl: # Only a piece of a long header line
+                pass
+            elif header:
+                headers.append(tonat(header, 'latin1'))
+                header = tob('')
+            else:
+                part = FileUpload.from_headers(headers, memfile_max)
+                headers = None
+        elif part is not None: # The newline before a separator is not data
+            size += len(newline) + len(line)
+            if part.filename is None and size > field_max:
+                raise HTTPError(413, 'Form field too large')
+            if count < max_parts:
+                part.file.write(newline)
+                part.file.write(line)
+            newline = nl
+        line_start = bool(nl)
+    raise HTTPError(400, 'Unexpected end of multipart body')
 
 
 class HeaderProperty(object):
@@ -1185,16 +1297,16 @@ class HeaderProperty(object):
 
     def __get__(self, obj, cls):
         if obj is None: return self
-        value = obj.headers.get(self.name)
+        value = obj.get_header(self.name)
         return self.reader(value) if (value and self.reader) else (value or self.default)
 
     def __set__(self, obj, value):
         if self.writer: value = self.writer(value)
-        obj.headers[self.name] = value
+        obj[self.name] = value
 
     def __delete__(self, obj):
-        if self.name in obj.headers:
-            del obj.headers[self.name]
+        if self.name in obj:
+            del obj[self.name]
 
 
 class BaseResponse(object):
@@ -1203,6 +1315,9 @@ class BaseResponse(object):
         This class does support dict-like case-insensitive item-access to
         headers, but is NOT a dict. Most notably, iterating over a response
         yields parts of the body and not the headers.
+
+        Headers are stored as a list of ``(name, value)`` tuples with
+        normalized names, ready to be passed to ``start_response``.
     """
 
     default_status = 200
@@ -1217,12 +1332,15 @@ class BaseResponse(object):
                   'Content-Md5', 'Last-Modified'))}
 
     def __init__(self, body='', status=None, **headers):
-        self._status_line = None
-        self._status_code = None
         self.body = body
         self._cookies = None
-        self._headers = {'Content-Type': [self.default_content_type]}
-        self.status = status or self.default_status
+        self._headers = [('Content-Type', self.default_content_type)]
+        code = status or self.default_status
+        line = _HTTP_STATUS_LINES.get(code)
+        if line: # Known numeric status, no need to parse anything
+            self._status_code, self._status_line = code, line
+        else:
+            self.status = code
         if headers:
             for name, value in headers.items():
                 self[name] = value
@@ -1230,8 +1348,8 @@ class BaseResponse(object):
     def copy(self):
         ''' Returns a copy of self. '''
         copy = Response()
-        copy.status = self.status
-        copy._headers = dict((k, v[:]) for (k, v) in self._headers.items())
+        copy.status = self.status_line
+        copy._headers = list(self._headers)
         return copy
 
     def __iter__(self):
@@ -1278,21 +1396,41 @@ class BaseResponse(object):
 
     @property
     def headers(self):
-        ''' An instance of :class:`HeaderDict`, a case-insensitive dict-like
-            view on the response headers. '''
-        self.__dict__['headers'] = hdict = HeaderDict()
-        hdict.dict = self._headers
-        return hdict
-
-    def __contains__(self, name): return _hkey(name) in self._headers
-    def __delitem__(self, name):  del self._headers[_hkey(name)]
-    def __getitem__(self, name):  return self._headers[_hkey(name)][-1]
-    def __setitem__(self, name, value): self._headers[_hkey(name)] = [str(value)]
+        ''' A :class:`HeaderDict` compatible, case-insensitive dict-like view
+            on the response headers. '''
+        return ResponseHeaders(self)
+
+    def __contains__(self, name):
+        name = _hkey(name)
+        for key, value in self._headers:
+            if key == name: return True
+        return False
+
+    def __delitem__(self, name):
+        name, headers = _hkey(name), self._headers
+        kept = [h for h in headers if h[0] != name]
+        if len(kept) == len(headers): raise KeyError(name)
+        self._headers = kept
+
+    def __getitem__(self, name):
+        name = _hkey(name)
+        for key, value in reversed(self._headers):
+            if key == name: return value
+        raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        name = _hkey(name)
+        headers = [h for h in self._headers if h[0] != name]
+        headers.append((name, str(value)))
+        self._headers = headers
 
     def get_header(self, name, default=None):
         ''' Return the value of a previously defined header. If there is no
             header with that name, return a default value. '''
-        return self._headers.get(_hkey(name), [default])[-1]
+        name = _hkey(name)
+        for key, value in reversed(self._headers):
+            if key == name: return value
+        return default
 
     def set_header(self, name, value, append=False):
         ''' Create a new response header, replacing any previously defined
@@ -1300,25 +1438,16 @@ class BaseResponse(object):
         if append:
             self.add_header(name, value)
         else:
-            self._headers[_hkey(name)] = [str(value)]
+            self[name] = value
 
     def add_header(self, name, value):
         ''' Add an additional response header, not removing duplicates. '''
-        self._headers.setdefault(_hkey(name), []).append(str(value))
+        self._headers.append((_hkey(name), str(value)))
 
     def iter_headers(self):
         ''' Yield (header, value) tuples, skipping headers that are not
             allowed with the current response status code. '''
-        headers = self._headers.iteritems()
-        bad_headers = self.bad_headers.get(self.status_code)
-        if bad_headers:
-            headers = [h for h in headers if h[0] not in bad_headers]
-        for name, values in headers:
-            for value in values:
-                yield name, value
-        if self._cookies:
-            for c in self._cookies.values():
-                yield 'Set-Cookie', c.OutputString()
+        return iter(self.headerlist)
 
     def wsgiheader(self):
         depr('The wsgiheader method is deprecated. See headerlist.') #0.10
@@ -1326,8 +1455,18 @@ class BaseResponse(object):
 
     @property
     def headerlist(self):
-        ''' WSGI conform list of (header, value) tuples. '''
-        return list(self.iter_headers())
+        ''' WSGI conform list of (header, value) tuples, skipping headers that
+            are not allowed with the current response status code. A new
+            list each time, servers may append to it. '''
+        bad_headers = self.bad_headers.get(self._status_code)
+        if bad_headers:
+            headers = [h for h in self._headers if h[0] not in bad_headers]
+        else:
+            headers = list(self._headers)
+        if self._cookies:
+            headers.extend(('Set-Cookie', c.OutputString())
+                           for c in self._cookies.values())
+        return headers
 
     content_type = HeaderProperty('Content-Type')
     content_length = HeaderProperty('Content-Length', reader=int)
@@ -1641,20 +1780,100 @@ class FormsDict(MultiDict):
     #: Encoding used for attribute values.
     input_encoding = 'utf8'
 
+    def __init__(self, *a, **k):
+        MultiDict.__init__(self, *a, **k)
+        self._decoded = {}
+
     def getunicode(self, name, default=None, encoding=None):
         value, enc = self.get(name, default), encoding or self.input_encoding
+        # Decoded values are cached together with the raw value they were
+        # decoded from, so a changed value is simply decoded again.
+        cached = self._decoded.get((name, enc))
+        if cached and cached[0] is value: return cached[1]
         try:
             if isinstance(value, bytes): # Python 2 WSGI
-                return value.decode(enc)
+                decoded = value.decode(enc)
             elif isinstance(value, unicode): # Python 3 WSGI
-                return value.encode('latin1').decode(enc)
-            return value
+                decoded = value.encode('latin1').decode(enc)
+            else:
+                return value
         except UnicodeError, e:
             return default
+        self._decoded[(name, enc)] = (value, decoded)
+        return decoded
 
     def __getattr__(self, name): return self.getunicode(name, default=u'')
 
 
+class ChainedFormsDict(FormsDict):
+    ''' A read-only :class:`FormsDict` view over several multi-dicts. Values
+        are looked up in the underlying dicts on demand, so nothing is copied
+        up front. For keys present in more than one dict, the values of later
+        dicts come last and win. '''
+
+    def __init__(self, *dicts):
+        self.dicts = dicts
+        self._decoded = {}
+
+    def __len__(self): return len(set(self.iterkeys()))
+    def __iter__(self): return self.iterkeys()
+    def __contains__(self, key):
+        for d in self.dicts:
+            if key in d.dict: return True
+        return False
+    def __getitem__(self, key):
+        for d in reversed(self.dicts):
+            if key in d.dict: return d.dict[key][-1]
+        raise KeyError(key)
+    def __setitem__(self, key, value):
+        raise TypeError("%s is read-only." % self.__class__)
+    def __delitem__(self, key):
+        raise TypeError("%s is read-only." % self.__class__)
+    append = replace = __setitem__
+
+    def iterkeys(self):
+        seen = set()
+        for d in self.dicts:
+            for key in d.dict:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+    def itervalues(self): return (self[k] for k in self.iterkeys())
+    def iteritems(self): return ((k, self[k]) for k in self.iterkeys())
+    def iterallitems(self):
+        for key in self.iterkeys():
+            for value in self.getall(key):
+                yield key, value
+
+    keys     = iterkeys     if py3k else lambda self: list(self.iterkeys())
+    values   = itervalues   if py3k else lambda self: list(self.itervalues())
+    items    = iteritems    if py3k else lambda self: list(self.iteritems())
+    allitems = iterallitems if py3k else lambda self: list(self.iterallitems())
+
+    def get(self, key, default=None, index=-1, type=None):
+        if index == -1: # The common case does not need a combined list
+            if key not in self: return default
+            val = self[key]
+            try:
+                return type(val) if type else val
+            except Exception, e:
+                return default
+        try:
+            val = self.getall(key)[index]
+            return type(val) if type else val
+        except Exception, e:
+            pass
+        return default
+
+    def getall(self, key):
+        found = [d.dict[key] for d in self.dicts if key in d.dict]
+        if len(found) == 1: return found[0][:]
+        return [value for values in found for value in values]
+
+    getone = get
+    getlist = getall
+
+
 class HeaderDict(MultiDict):
     """ A case-insensitive version of :class:`MultiDict` that defaults to
         replace the old value instead of appending it. """
@@ -1679,6 +1898,51 @@ class HeaderDict(MultiDict):
                 del self.dict[name]
 
 
+class ResponseHeaders(HeaderDict):
+    """ A :class:`HeaderDict` compatible view on the header list of a
+        :class:`BaseResponse`. Changes are applied to the response. """
+
+    def __init__(self, response):
+        self.response = response
+
+    def __len__(self): return len(self.keys())
+    def __iter__(self): return self.iterkeys()
+    def __contains__(self, key): return key in self.response
+    def __delitem__(self, key): del self.response[key]
+    def __getitem__(self, key): return self.response[key]
+    def __setitem__(self, key, value): self.response[key] = value
+    def append(self, key, value): self.response.add_header(key, value)
+    def replace(self, key, value): self.response[key] = value
+    def getall(self, key):
+        key = _hkey(key)
+        return [v for (k, v) in self.response._headers if k == key]
+    def get(self, key, default=None, index=-1, type=None):
+        try:
+            val = self.getall(key)[index]
+            return type(val) if type else val
+        except Exception, e:
+            pass
+        return default
+    def filter(self, names):
+        for name in names:
+            if name in self: del self[name]
+
+    def iterkeys(self):
+        seen = set()
+        for key, value in self.response._headers:
+            if key not in seen:
+                seen.add(key)
+                yield key
+    def itervalues(self): return (self[k] for k in self.iterkeys())
+    def iteritems(self): return ((k, self[k]) for k in self.iterkeys())
+    def iterallitems(self): return iter(list(self.response._headers))
+
+    keys     = iterkeys     if py3k else lambda self: list(self.iterkeys())
+    values   = itervalues   if py3k else lambda self: list(self.itervalues())
+    items    = iteritems    if py3k else lambda self: list(self.iteritems())
+    allitems = iterallitems if py3k else lambda self: list(self.iterallitems())
+
+
 class WSGIHeaderDict(DictMixin):
     ''' This dict-like class wraps a WSGI environ dict and provides convenient
         access to HTTP_* fields. Keys and values are native strings
@@ -1776,6 +2040,57 @@ class AppStack(list):
         return value
 
 
+class FileUpload(object):
+    ''' A single part of a `multipart/form-data` request body, with the same
+        attributes as a :class:`cgi.FieldStorage` item:
+
+        name
+            The name of the form field.
+        filename
+            The client side file name for file uploads, otherwise None.
+        file
+            A file(-like) object with the data. File uploads larger than
+            :attr:`BaseRequest.MEMFILE_MAX` are spooled to a temporary file.
+        value
+            The data as a native string. For file uploads, this reads the
+            whole file every time you request the value. Do not do this on
+            big files.
+    '''
+
+    def __init__(self, name, filename, headers, fileobj):
+        self.name, self.filename = name, filename
+        self.headers, self.file = headers, fileobj
+        self.type = headers.get('Content-Type', 'text/plain')
+
+    @classmethod
+    def from_headers(cls, lines, memfile_max):
+        ''' Create an empty upload from the header lines of a part. '''
+        headers = HeaderDict()
+        for line in lines:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip()] = value.strip()
+        disposition, options = cgi.parse_header(
+            headers.get('Content-Disposition', ''))
+        filename = options.get('filename')
+        if filename is None:
+            fileobj = BytesIO()
+        else:
+            fileobj = tempfile.SpooledTemporaryFile(max_size=memfile_max)
+        return cls(options.get('name', ''), filename, headers, fileobj)
+
+    @property
+    def value(self):
+        self.file.seek(0)
+        value = self.file.read()
+        self.file.seek(0)
+        return touni(value, 'latin1') if py3k else value
+
+    def __repr__(self):
+        return '<%s: %r (%r)>' % (self.__class__.__name__, self.name,
+                                   self.filename)
+
+
 class WSGIFileWrapper(object):
 
    def __init__(self, fp, buffer_size=1024*64):
@@ -2031,7 +2346,7 @@ def make_default_app_wrapper(name):
 
 
 for name in '''route get post put delete error mount
-               hook install uninstall'''.split():
+               hook install uninstall prepare_all'''.split():
     globals()[name] = make_default_app_wrapper(name)
 url = make_default_app_wrapper('get_url')
 del name
@@ -2089,6 +2404,799 @@ class WSGIRefServer(ServerAdapter):
         srv.serve_forever()
 
 
+class PreforkServer(ServerAdapter):
+    """ Pre-forking server for POSIX systems. The application is loaded once
+        in the master process, which then forks `workers` processes (default:
+        number of CPUs) that serve requests from a shared listening socket
+        with wsgiref. Workers share the loaded application with the master
+        through copy-on-write memory. Crashed workers are replaced.
+
+        * SIGHUP replaces the workers one at a time with fresh forks of the
+          master. Each worker finishes its current request before it exits.
+          Changed Python code still needs a restart of the master (or the
+          reloader).
+        * SIGTERM and SIGINT stop all workers gracefully.
+    """
+    def run(self, handler): # pragma: no cover
+        import signal, socket, random
+        from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+        workers = int(self.options.get('workers', 0))
+        if not workers:
+            try:
+                import multiprocessing
+                workers = multiprocessing.cpu_count()
+            except (ImportError, NotImplementedError):
+                workers = 2
+
+        def app(environ, start_response):
+            environ['wsgi.multithread'] = False
+            environ['wsgi.multiprocess'] = True
+            return handler(environ, start_response)
+
+        class PreboundServer(WSGIServer):
+            def server_bind(self): # The socket is bound by the master
+                host, port = self.socket.getsockname()[:2]
+                self.server_name = socket.getfqdn(host)
+                self.server_port = port
+                self.setup_environ()
+
+            def get_request(self):
+                # On BSD and OS X the accepted socket inherits O_NONBLOCK
+                conn, addr = self.socket.accept()
+                conn.setblocking(1)
+                return conn, addr
+
+        handler_class = WSGIRequestHandler
+        if self.quiet:
+            class QuietHandler(WSGIRequestHandler):
+                def log_request(*args, **kw): pass
+            handler_class = QuietHandler
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.options.get('backlog', 128))
+        # Idle workers all wake up on a new connection. The ones that lose
+        # the race must not block in accept().
+        sock.setblocking(0)
+        srv = PreboundServer((self.host, self.port), handler_class, False)
+        srv.socket.close()
+        srv.socket = sock
+        srv.server_bind()
+        srv.set_app(app)
+        srv.timeout = 0.5
+
+        def worker():
+            stopping = []
+            signal.signal(signal.SIGINT, signal.SIG_IGN) # The master decides
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, lambda *a: stopping.append(True))
+            random.seed() # Do not share random state with other workers
+            while not stopping:
+                srv.handle_request()
+
+        def spawn():
+            pid = os.fork()
+            if pid: return pid
+            status = 0
+            try:
+                worker()
+            except BaseException:
+                print_exc()
+                status = 1
+            finally:
+                os._exit(status)
+
+        def reap(block=False):
+            ''' Return the pids of workers that exited. '''
+            dead = []
+            while pids:
+                try:
+                    pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+                except OSError: # Interrupted, or no children left
+                    break
+                if not pid: break
+                if pid in pids:
+                    pids.remove(pid)
+                    dead.append(pid)
+                if block: break
+            return dead
+
+        def stop(pid):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+        def respawn(dead):
+            for pid in dead:
+                if not self.quiet:
+                    sys.stderr.write('Worker %d died. Restarting.\n' % pid)
+                time.sleep(0.1) # Do not spin if workers die at startup
+                pids.add(spawn())
+
+        pending = []
+        signal.signal(signal.SIGHUP, lambda *a: pending.append('reload'))
+        signal.signal(signal.SIGTERM, lambda *a: pending.append('stop'))
+        pids = set(spawn() for i in xrange(workers))
+        try:
+            while 'stop' not in pending:
+                if pending: # Rolling restart
+                    del pending[:]
+                    for old in list(pids):
+                        pids.add(spawn())
+                        stop(old)
+                        while old in pids and 'stop' not in pending:
+                            respawn(pid for pid in reap(block=True) if pid != old)
+                respawn(reap())
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for pid in pids: stop(pid)
+            while pids and reap(block=True): pass
+            sock.close()
+
+
+def _parse_http_head(head):
+    ''' Parse the request line and header fields of an HTTP request into a
+        ``(method, target, version, headers)`` tuple. Raises :exc:`ValueError`
+        on malformed input. '''
+    lines = head.split('\r\n')
+    method, target, version = lines[0].split(' ')
+    if not version.startswith('HTTP/1.'): raise ValueError('Bad version')
+    headers = []
+    for line in lines[1:]:
+        if line[:1] in (' ', '\t') and headers: # Obsolete line folding
+            headers[-1] = (headers[-1][0], headers[-1][1] + ' ' + line.strip())
+        else:
+            name, value = line.split(':', 1)
+            if not name or name != name.strip(): raise ValueError('Bad header')
+            headers.append((name, value.strip()))
+    return method, target, version, headers
+
+
+class _BodyReader(object):
+    ''' The ``wsgi.input`` stream of a :class:`_ServerConnection`. Reads at
+        most `length` bytes of the request body. '''
+
+    def __init__(self, conn, length, expect_continue=False):
+        self.conn, self.remaining = conn, length
+        self.expect_continue = expect_continue
+
+    def _fill(self):
+        if self.expect_continue: # The client waits for this before sending
+            self.expect_continue = False
+            self.conn.send('HTTP/1.1 100 Continue\r\n\r\n')
+        if not self.conn.recv(): raise IOError('Connection closed by client.')
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining: size = self.remaining
+        while len(self.conn.buf) < size: self._fill()
+        data, self.conn.buf = self.conn.buf[:size], self.conn.buf[size:]
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size < 0 or size > self.remaining: size = self.remaining
+        while True:
+            end = self.conn.buf.find('\n', 0, size) + 1
+            if end or len(self.conn.buf) >= size: break
+            self._fill()
+        return self.read(end or size)
+
+    def readlines(self, hint=None):
+        return list(self)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line: return
+            yield line
+
+
+class _ServerConnection(object):
+    ''' A client connection of an HTTP/1.1 server adapter. Requests are read
+        from the socket, passed to the WSGI application and the responses are
+        written back, keeping the connection alive where possible. '''
+
+    #: Largest accepted request line and header block (bytes).
+    max_head = 65536
+    #: Largest unread request body that is skipped to keep a connection alive.
+    max_drain = 65536
+
+    def __init__(self, sock, addr, environ, quiet=False):
+        self.sock, self.addr, self.buf = sock, addr, ''
+        self.environ, self.quiet = environ, quiet
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv(self):
+        ''' Read more data into the buffer. Return False on EOF. '''
+        data = self.sock.recv(65536)
+        self.buf += data
+        return bool(data)
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+    def reject(self, status='503 Service Unavailable'):
+        ''' Answer with an error status and close the connection. '''
+        try:
+            self.send('HTTP/1.1 %s\r\nContent-Length: 0\r\n'
+                      'Connection: close\r\n\r\n' % status)
+        except Exception:
+            pass
+        self.close()
+
+    def read_head(self):
+        ''' Return the next request head, or None if the client is done. '''
+        while True:
+            self.buf = self.buf.lstrip('\r\n')
+            end = self.buf.find('\r\n\r\n')
+            if end >= 0:
+                head, self.buf = self.buf[:end], self.buf[end+4:]
+                return head
+            if len(self.buf) > self.max_head:
+                raise ValueError('Request head too large.')
+            if not self.recv():
+                return None
+
+    def serve(self, app):
+        ''' Serve requests until the connection has to be closed (returns
+            False) or the client is idle with no pipelined request left in
+            the buffer (returns True). '''
+        while True:
+            try:
+                head = self.read_head()
+                if head is None: return False
+                request = _parse_http_head(head)
+            except ValueError:
+                self.reject('400 Bad Request')
+                return False
+            if not self.handle(app, *request): return False
+            if not self.buf: return True
+
+    def handle(self, app, method, target, version, headers):
+        ''' Handle a single request. Return True to keep the connection. '''
+        environ = self.environ.copy()
+        if '://' in target: # Absolute URI, used by proxies
+            target = '/' + target.split('://', 1)[1].partition('/')[2]
+        path, _, query = target.partition('?')
+        environ['REQUEST_METHOD'] = method
+        environ['PATH_INFO'] = urlunquote(path)
+        environ['QUERY_STRING'] = query
+        environ['SERVER_PROTOCOL'] = version
+        environ['REMOTE_ADDR'] = self.addr[0]
+        for name, value in headers:
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            if key in environ:
+                value = environ[key] + ',' + value
+            environ[key] = value
+
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        if version == 'HTTP/1.0': keep_alive = 'keep-alive' in connection
+        else: keep_alive = 'close' not in connection
+        if environ.get('HTTP_TRANSFER_ENCODING', 'identity') != 'identity':
+            self.reject('501 Not Implemented') # Chunked request bodies
+            return False
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            if length < 0: raise ValueError()
+        except ValueError:
+            self.reject('400 Bad Request')
+            return False
+        expect = environ.get('HTTP_EXPECT', '').lower() == '100-continue'
+        body = environ['wsgi.input'] = _BodyReader(self, length, expect)
+
+        state = {'status': None, 'headers': None, 'sent': False,
+                 'chunked': False, 'length': None, 'written': 0,
+                 'keep': keep_alive}
+        no_body = method == 'HEAD'
+
+        def start_response(status, headerlist, exc_info=None):
+            if exc_info:
+                try:
+                    if state['sent']: raise exc_info[0], exc_info[1], exc_info[2]
+                finally:
+                    exc_info = None
+            elif state['status']:
+                raise AssertionError('Headers already set.')
+            state['status'], state['headers'] = status, list(headerlist)
+            return write
+
+        def send_head():
+            status, headerlist = state['status'], state['headers']
+            code = int(status[:3])
+            names = set(name.lower() for name, value in headerlist)
+            if 'close' in [v.lower() for n, v in headerlist if n.lower() == 'connection']:
+                state['keep'] = False
+            headerlist = [(n, v) for (n, v) in headerlist if n.lower() != 'connection']
+            if no_body or code < 200 or code in (204, 304):
+                pass
+            elif 'content-length' in names:
+                for name, value in headerlist:
+                    if name.lower() == 'content-length': state['length'] = int(value)
+            elif version == 'HTTP/1.1':
+                state['chunked'] = True
+                headerlist.append(('Transfer-Encoding', 'chunked'))
+            else: # HTTP/1.0 without a length: The end of the body is the end
+                state['keep'] = False # of the connection.
+            if 'date' not in names:
+                headerlist.append(('Date', email.utils.formatdate(usegmt=True)))
+            if not state['keep']:
+                headerlist.append(('Connection', 'close'))
+            elif version == 'HTTP/1.0':
+                headerlist.append(('Connection', 'keep-alive'))
+            state['sent'] = True
+            return 'HTTP/1.1 %s\r\n%s\r\n' % (status,
+                   ''.join('%s: %s\r\n' % h for h in headerlist))
+
+        def write(data):
+            if not state['status']: raise AssertionError('write() before start_response()')
+            out = send_head() if not state['sent'] else ''
+            if data and not no_body:
+                state['written'] += len(data)
+                if state['chunked']: data = '%x\r\n%s\r\n' % (len(data), data)
+                out += data
+            if out: self.send(out)
+
+        result = None
+        try:
+            result = app(environ, start_response)
+            for data in result:
+                if data: write(data)
+            if not state['sent']: write('')
+            if state['chunked']: self.send('0\r\n\r\n')
+        except IOError: # Includes socket errors
+            return False
+        except Exception:
+            if not self.quiet: print_exc()
+            if not state['sent']: self.reject('500 Internal Server Error')
+            return False
+        finally:
+            if hasattr(result, 'close'): result.close()
+        if not self.quiet:
+            sys.stderr.write('%s - - [%s] "%s %s %s" %s %s\n' % (self.addr[0],
+                time.strftime('%d/%b/%Y %H:%M:%S'), method, target, version,
+                state['status'][:3], state['written']))
+        if state['length'] is not None and state['length'] != state['written']:
+            return False # The client would wait for more (or read garbage)
+        if (body.expect_continue and body.remaining)\
+        or body.remaining > self.max_drain:
+            return False # Do not wait for a body that was never asked for
+        try:
+            while body.remaining: body.read(body.remaining)
+        except IOError:
+            return False
+        return state['keep']
+
+
+class ThreadPoolServer(ServerAdapter):
+    """ Multi-threaded HTTP/1.1 server that only needs the standard library.
+
+        The main thread accepts connections and hands them to a pool of
+        `threads` worker threads (default: 10) through a queue of at most
+        `queue_size` connections (default: 4 * threads). When the queue stays
+        full for `queue_timeout` seconds (default: 5), a new connection is
+        answered with ``503 Service Unavailable``.
+
+        HTTP/1.1 keep-alive and pipelining are supported. Idle keep-alive
+        connections go back to the main thread, so they do not block a
+        worker, and are closed after `keepalive` seconds (default: 15) or when
+        more than `max_idle` (default: 512) are open. A client that is slower
+        than `timeout` seconds (default: 30) on a single read or write is
+        disconnected.
+    """
+    def run(self, handler): # pragma: no cover
+        import select, Queue
+        threads = int(self.options.get('threads', 10))
+        queue_size = int(self.options.get('queue_size', 4 * threads))
+        queue_timeout = float(self.options.get('queue_timeout', 5))
+        keepalive = float(self.options.get('keepalive', 15))
+        max_idle = int(self.options.get('max_idle', 512))
+        timeout = float(self.options.get('timeout', 30))
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.options.get('backlog', 128))
+        environ = {'SERVER_NAME': socket.getfqdn(self.host),
+                   'SERVER_PORT': str(sock.getsockname()[1]),
+                   'SCRIPT_NAME': '', 'wsgi.version': (1, 0),
+                   'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr,
+                   'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                   'wsgi.run_once': False}
+
+        # Workers return idle connections to the main thread and wake it up
+        # through a socket pair (or it checks every 50ms, if there is none).
+        if hasattr(socket, 'socketpair'):
+            wake_r, wake_w = socket.socketpair()
+            wake_r.setblocking(0)
+        else:
+            wake_r = wake_w = None
+        returned, lock = [], threading.Lock()
+        jobs = Queue.Queue(queue_size)
+
+        def worker():
+            while True:
+                conn = jobs.get()
+                try:
+                    idle = conn.serve(handler)
+                except Exception: # Timeouts and broken connections
+                    idle = False
+                if not idle:
+                    conn.close()
+                    continue
+                with lock: returned.append(conn)
+                if wake_w:
+                    try: wake_w.send('x')
+                    except socket.error: pass
+
+        for i in xrange(threads):
+            t = threading.Thread(target=worker)
+            t.daemon = True
+            t.start()
+
+        def dispatch(conn):
+            try:
+                jobs.put(conn, timeout=queue_timeout)
+            except Queue.Full:
+                conn.reject()
+
+        idle = {} # Idle keep-alive connections and when they expire
+        try:
+            while True:
+                rlist = [sock] + idle.keys() + ([wake_r] if wake_r else [])
+                wait = 1.0 if wake_r else 0.05
+                for ready in select.select(rlist, [], [], wait)[0]:
+                    if ready is sock:
+                        try:
+                            client, addr = sock.accept()
+                        except socket.error:
+                            continue
+                        client.settimeout(timeout)
+                        dispatch(_ServerConnection(client, addr, environ, self.quiet))
+                    elif ready is wake_r:
+                        try: wake_r.recv(4096)
+                        except socket.error: pass
+                    else:
+                        del idle[ready]
+                        dispatch(ready)
+                now = time.time()
+                with lock:
+                    for conn in returned: idle[conn] = now + keepalive
+                    del returned[:]
+                while len(idle) > max_idle:
+                    conn = min(idle, key=idle.get)
+                    del idle[conn]
+                    conn.close()
+                for conn, expires in idle.items():
+                    if expires < now:
+                        del idle[conn]
+                        conn.close()
+        finally:
+            sock.close()
+            for conn in idle: conn.close()
+
+
+class _LoopConnection(_ServerConnection):
+    ''' A client connection of the :class:`EventLoopServer`. The event loop
+        reads a complete request before a worker thread handles it. The
+        response is queued by the worker and written by the event loop. '''
+
+    #: The body is already in the buffer, skipping it costs nothing.
+    max_drain = sys.maxint
+    #: A worker waits while this many bytes are queued for the client.
+    max_queued = 65536
+
+    def __init__(self, sock, addr, environ, quiet, notify):
+        _ServerConnection.__init__(self, sock, addr, environ, quiet)
+        self.notify = notify # Called whenever the event loop has work to do
+        self.cond = threading.Condition()
+        self.out, self.queued = [], 0
+        self.state, self.request, self.length = 'head', None, 0
+        self.open, self.closed, self.deadline = True, False, None
+
+    def send(self, data):
+        ''' Queue data for the event loop. Blocks while the client is slow. '''
+        with self.cond:
+            while self.queued > self.max_queued and not self.closed:
+                self.cond.wait()
+            if self.closed: raise IOError('Connection closed by client.')
+            self.out.append(data)
+            self.queued += len(data)
+        self.notify(self)
+
+    def close(self):
+        ''' Close the connection as soon as the queued data is written. '''
+        self.open = False
+
+    def finish(self, keep):
+        ''' Called by the worker thread when the response is complete. '''
+        if not keep: self.open = False
+        self.state = 'done'
+        self.notify(self)
+
+    def flush(self):
+        ''' Write as much queued data as the socket accepts without blocking.
+            Return the number of bytes written. '''
+        written = 0
+        with self.cond:
+            if len(self.out) > 1: self.out = [''.join(self.out)]
+            while self.out:
+                try:
+                    sent = self.sock.send(self.out[0])
+                except socket.error, e:
+                    if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK): break
+                    raise
+                written += sent
+                self.queued -= sent
+                if sent < len(self.out[0]):
+                    self.out[0] = self.out[0][sent:]
+                    break
+                del self.out[0]
+            if self.queued <= self.max_queued: self.cond.notify_all()
+        return written
+
+    def abort(self):
+        ''' Close the socket and wake up a worker that waits in send(). '''
+        with self.cond:
+            self.closed = True
+            self.out, self.queued = [], 0
+            self.cond.notify_all()
+        _ServerConnection.close(self)
+
+
+class EventLoopServer(ServerAdapter):
+    """ Event loop HTTP/1.1 server that only needs the standard library.
+
+        A single thread watches all connections with epoll (or select, where
+        epoll is not available) and never blocks on a client. It reads
+        complete requests, hands them to a pool of `threads` worker threads
+        (default: 10) and writes the responses back while the application
+        produces them. A worker waits while the client is slow to read,
+        so large responses are never buffered in full.
+
+        Idle keep-alive connections only cost a file descriptor and are
+        closed after `keepalive` seconds (default: 15). A client has
+        `timeout` seconds (default: 10) to send the request head. The body
+        must arrive at 4kB/s or faster, up to `max_body` bytes (default:
+        10MB). A stalled write is aborted after the same `timeout`.
+
+        At most `queue_size` requests (default: 4 * threads) are queued for
+        the workers, more wait in the event loop. A request that waits for
+        longer than `queue_timeout` seconds (default: 5) is answered with
+        ``503 Service Unavailable``.
+
+        Python 2 has no ``asyncio`` module, so this adapter is also available
+        as ``server='asyncio'``.
+    """
+    def run(self, handler): # pragma: no cover
+        import select, Queue, collections
+        threads = int(self.options.get('threads', 10))
+        queue_size = int(self.options.get('queue_size', 4 * threads))
+        queue_timeout = float(self.options.get('queue_timeout', 5))
+        keepalive = float(self.options.get('keepalive', 15))
+        timeout = float(self.options.get('timeout', 10))
+        max_body = int(self.options.get('max_body', 10 * 1024 * 1024))
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.options.get('backlog', 1024))
+        sock.setblocking(0)
+        environ = {'SERVER_NAME': socket.getfqdn(self.host),
+                   'SERVER_PORT': str(sock.getsockname()[1]),
+                   'SCRIPT_NAME': '', 'wsgi.version': (1, 0),
+                   'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr,
+                   'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                   'wsgi.run_once': False}
+
+        # Workers wake up the event loop through a socket pair (or it checks
+        # every 50ms, if there is none).
+        if hasattr(socket, 'socketpair'):
+            wake_r, wake_w = socket.socketpair()
+            wake_r.setblocking(0)
+        else:
+            wake_r = wake_w = None
+        pending, lock = [], threading.Lock()
+        jobs, waiting = Queue.Queue(queue_size), collections.deque()
+
+        def notify(conn):
+            with lock:
+                pending.append(conn)
+                if len(pending) > 1 or not wake_w: return
+            try: wake_w.send('x')
+            except socket.error: pass
+
+        def worker():
+            while True:
+                conn = jobs.get()
+                try:
+                    keep = conn.handle(handler, *conn.request)
+                except Exception:
+                    keep = False
+                conn.finish(keep)
+
+        for i in xrange(threads):
+            t = threading.Thread(target=worker)
+            t.daemon = True
+            t.start()
+
+        if hasattr(select, 'epoll'):
+            poller, masks = select.epoll(), {}
+            def watch(fd, read, write):
+                mask = (read and select.EPOLLIN) | (write and select.EPOLLOUT)
+                if fd not in masks: poller.register(fd, mask)
+                elif masks[fd] != mask: poller.modify(fd, mask)
+                masks[fd] = mask
+            def forget(fd):
+                if masks.pop(fd, None) is not None: poller.unregister(fd)
+            def wait(seconds):
+                for fd, ev in poller.poll(seconds):
+                    yield fd, ev & ~select.EPOLLOUT, ev & select.EPOLLOUT
+        else:
+            rset, wset = set(), set()
+            def watch(fd, read, write):
+                (rset.add if read else rset.discard)(fd)
+                (wset.add if write else wset.discard)(fd)
+            def forget(fd):
+                rset.discard(fd)
+                wset.discard(fd)
+            def wait(seconds):
+                r, w, x = select.select(rset, wset, [], seconds)
+                for fd in set(r) | set(w): yield fd, fd in r, fd in w
+
+        conns = {} # File descriptors of open client connections
+
+        def drop(conn):
+            if conn.closed: return
+            fd = conn.fileno()
+            forget(fd)
+            del conns[fd]
+            conn.abort()
+
+        def parse(conn):
+            ''' Turn a complete request head into a job. Return False if the
+                connection was rejected. '''
+            head, conn.buf = conn.buf.split('\r\n\r\n', 1)
+            try:
+                method, target, version, headers = _parse_http_head(head)
+                names = dict((n.lower(), v) for n, v in headers)
+                if names.get('transfer-encoding', 'identity') != 'identity':
+                    conn.reject('501 Not Implemented')
+                    return False
+                length = int(names.get('content-length') or 0)
+                if length < 0: raise ValueError('Bad Content-Length')
+            except ValueError:
+                conn.reject('400 Bad Request')
+                return False
+            if length > max_body:
+                conn.reject('413 Request Entity Too Large')
+                return False
+            if names.get('expect', '').lower() == '100-continue':
+                headers = [h for h in headers if h[0].lower() != 'expect']
+                if length > len(conn.buf):
+                    conn.send('HTTP/1.1 100 Continue\r\n\r\n')
+            conn.request = (method, target, version, headers)
+            conn.length, conn.state = length, 'body'
+            conn.deadline = time.time() + timeout + length / 4096.0
+            return True
+
+        def update(conn):
+            ''' Advance the connection state and update the poller. '''
+            if conn.closed: return
+            if conn.state == 'done' and not conn.queued:
+                if not conn.open: return drop(conn)
+                conn.state = 'head' # Keep-alive, maybe with a pipelined request
+                conn.deadline = time.time() + (timeout if conn.buf else keepalive)
+            if conn.state == 'head':
+                conn.buf = conn.buf.lstrip('\r\n')
+                if '\r\n\r\n' in conn.buf:
+                    if not parse(conn): conn.state = 'done'
+                elif len(conn.buf) > _ServerConnection.max_head:
+                    conn.reject('400 Bad Request')
+                    conn.state = 'done'
+            if conn.state == 'body' and len(conn.buf) >= conn.length:
+                conn.state = 'queued'
+                conn.deadline = time.time() + queue_timeout
+                waiting.append(conn)
+                dispatch()
+            if conn.state in ('busy', 'done') and conn.queued\
+            and conn.deadline is None: # The client has to read in time
+                conn.deadline = time.time() + timeout
+            watch(conn.fileno(), conn.state in ('head', 'body'), conn.queued)
+
+        def dispatch():
+            ''' Move waiting requests to the worker queue while it has room. '''
+            while waiting and not jobs.full():
+                conn = waiting.popleft()
+                if conn.closed or conn.state != 'queued': continue
+                conn.state, conn.deadline = 'busy', None
+                jobs.put_nowait(conn)
+
+        def accept():
+            while True:
+                try:
+                    client, addr = sock.accept()
+                except socket.error, e:
+                    if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK): return
+                    if e.args[0] in (errno.EMFILE, errno.ENFILE): return
+                    continue
+                client.setblocking(0)
+                conn = _LoopConnection(client, addr, environ, self.quiet, notify)
+                conn.deadline = time.time() + keepalive
+                conns[conn.fileno()] = conn
+                watch(conn.fileno(), True, False)
+
+        def receive(conn):
+            if conn.closed: return
+            try:
+                data = conn.sock.recv(65536)
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK): return
+                return drop(conn)
+            if not data: return drop(conn)
+            if not conn.buf and conn.state == 'head': # First byte of a request
+                conn.deadline = min(conn.deadline, time.time() + timeout)
+            conn.buf += data
+            update(conn)
+
+        watch(sock.fileno(), True, False)
+        if wake_r: watch(wake_r.fileno(), True, False)
+        sweep = time.time() + 1
+        try:
+            while True:
+                for fd, readable, writable in wait(1.0 if wake_r else 0.05):
+                    if fd == sock.fileno():
+                        accept()
+                    elif wake_r and fd == wake_r.fileno():
+                        try: wake_r.recv(4096)
+                        except socket.error: pass
+                    elif fd in conns:
+                        conn = conns[fd]
+                        if writable:
+                            try:
+                                if conn.flush() and conn.state in ('busy', 'done'):
+                                    conn.deadline = None
+                            except socket.error:
+                                drop(conn)
+                                continue
+                            update(conn)
+                        if readable and conn.state in ('head', 'body'):
+                            receive(conn)
+                        elif readable and not writable:
+                            drop(conn) # Hang-up or error while busy
+                with lock:
+                    work, pending[:] = pending[:], []
+                for conn in work: update(conn)
+                dispatch()
+                now = time.time()
+                if now > sweep:
+                    sweep = now + 1
+                    for conn in conns.values():
+                        if conn.deadline is None or conn.deadline > now:
+                            continue
+                        if conn.state == 'queued': # Still no worker available
+                            conn.reject('503 Service Unavailable')
+                            conn.state, conn.deadline = 'done', None
+                            update(conn)
+                        else:
+                            drop(conn)
+        finally:
+            sock.close()
+            for conn in conns.values(): conn.abort()
+
+
 class CherryPyServer(ServerAdapter):
     def run(self, handler): # pragma: no cover
         from cherrypy import wsgiserver
@@ -2252,6 +3360,10 @@ server_names = {
     'cgi': CGIServer,
     'flup': FlupFCGIServer,
     'wsgiref': WSGIRefServer,
+    'prefork': PreforkServer,
+    'threadpool': ThreadPoolServer,
+    'eventloop': EventLoopServer,
+    'asyncio': EventLoopServer,
     'cherrypy': CherryPyServer,
     'paste': PasteServer,
     'fapws3': FapwsServer,
@@ -2339,7 +3451,11 @@ def run(app=None, server='wsgiref', host='127.0.0.1', port=8080,
                 environ = os.environ.copy()
                 environ['BOTTLE_CHILD'] = 'true'
                 environ['BOTTLE_LOCKFILE'] = lockfile
+                if hasattr(os, 'getppid'): # The child can check on us
+                    environ['BOTTLE_PARENT'] = str(os.getpid())
                 p = subprocess.Popen(args, env=environ)
+                if 'BOTTLE_PARENT' in environ:
+                    p.wait()
                 while p.poll() is None: # Busy wait...
                     os.utime(lockfile, None) # I am alive!
                     time.sleep(interval)
@@ -2399,38 +3515,148 @@ def run(app=None, server='wsgiref', host='127.0.0.1', port=8080,
         if not getattr(server, 'quiet', False): stderr('Shutdown...\n')
 
 
+class Inotify(object):
+    ''' A minimal ctypes binding to the Linux inotify API. Directories are
+        watched, and :meth:`read` returns the paths of files that changed in
+        them. Raises :exc:`OSError` or :exc:`AttributeError` on platforms
+        without inotify. '''
+
+    #: IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO,
+    #: IN_CREATE and IN_DELETE
+    mask = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200
+
+    def __init__(self):
+        import ctypes, select, struct
+        self.select, self.struct = select.select, struct
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init() failed.')
+        self.dirs = {} # Maps watch descriptors to directories
+
+    def watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, tob(path), self.mask)
+        if wd >= 0: self.dirs[wd] = path
+
+    def read(self, timeout):
+        ''' Wait up to `timeout` seconds for events and return the paths that
+            changed (an empty list on timeout). '''
+        if not self.select([self.fd], [], [], timeout)[0]: return []
+        data, offset, paths = os.read(self.fd, 65536), 0, []
+        while offset + 16 <= len(data):
+            wd, mask, cookie, size = self.struct.unpack_from('iIII', data, offset)
+            name = data[offset+16:offset+16+size].rstrip(tob('\0'))
+            offset += 16 + size
+            if wd in self.dirs and name:
+                paths.append(os.path.join(self.dirs[wd], tonat(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
 class FileCheckerThread(threading.Thread):
-    ''' Interrupt main-thread as soon as a changed module file is detected,
-        the lockfile gets deleted or gets to old. '''
+    ''' Interrupt main-thread as soon as a changed module or template file is
+        detected, or the parent process is gone (the lockfile gets deleted or
+        gets to old). Only files inside the project directory and the
+        directories of loaded templates are watched. Changes are detected
+        with inotify where available and by polling every `interval` seconds
+        otherwise. '''
+
+    #: After a change, wait until no more changes arrive for this many
+    #: seconds before reloading. Editors and VCS checkouts write in bursts.
+    debounce = 0.05
 
     def __init__(self, lockfile, interval):
         threading.Thread.__init__(self)
         self.lockfile, self.interval = lockfile, interval
+        self.parent = int(os.environ.get('BOTTLE_PARENT') or 0)
         #: Is one of 'reload', 'error' or 'exit'
         self.status = None
 
-    def run(self):
-        exists = os.path.exists
-        mtime = lambda path: os.stat(path).st_mtime
-        files = dict()
-
+    def project_files(self):
+        ''' Return the source files of all loaded modules inside the project
+            directory and all files in the directories of loaded templates. '''
+        script = os.path.abspath(sys.argv[0] if sys.argv else '')
+        root = os.path.dirname(script) if os.path.isfile(script) else os.getcwd()
+        root = os.path.join(root, '')
+        files = set()
         for module in sys.modules.values():
-            path = getattr(module, '__file__', '')
+            path = getattr(module, '__file__', None) or ''
             if path[-4:] in ('.pyo', '.pyc'): path = path[:-1]
-            if path and exists(path): files[path] = mtime(path)
+            path = os.path.abspath(path) if path else ''
+            if path.startswith(root) and os.path.exists(path):
+                files.add(path)
+        for tpl in TEMPLATES.values():
+            for lookup in getattr(tpl, 'lookup', None) or ():
+                if not os.path.isdir(lookup): continue
+                for name in os.listdir(lookup):
+                    path = os.path.join(lookup, name)
+                    if os.path.isfile(path): files.add(path)
+        return files
+
+    def parent_alive(self):
+        if self.parent: # Cheaper than a lockfile and does not need a heartbeat
+            return os.getppid() == self.parent
+        exists, mtime = os.path.exists, lambda path: os.stat(path).st_mtime
+        return exists(self.lockfile)\
+           and mtime(self.lockfile) >= time.time() - self.interval - 5
+
+    def run(self):
+        try:
+            inotify = Inotify() if sys.platform.startswith('linux') else None
+        except (AttributeError, OSError):
+            inotify = None
+        try:
+            if inotify: self.watch(inotify)
+            else: self.poll()
+        finally:
+            if inotify: inotify.close()
+
+    def interrupt(self, status):
+        ''' Raise :exc:`KeyboardInterrupt` in the main thread. A real SIGINT
+            also wakes up a server that is blocked in a system call. '''
+        if self.status: return
+        self.status = status
+        import signal
+        if os.name == 'posix'\
+        and signal.getsignal(signal.SIGINT) is signal.default_int_handler:
+            os.kill(os.getpid(), signal.SIGINT)
+        else:
+            thread.interrupt_main()
+
+    def loaded(self):
+        return len(sys.modules), len(TEMPLATES)
 
+    def watch(self, inotify):
+        files, dirs, loaded = set(), set(), None
         while not self.status:
-            if not exists(self.lockfile)\
-            or mtime(self.lockfile) < time.time() - self.interval - 5:
-                self.status = 'error'
-                thread.interrupt_main()
-            for path, lmtime in files.iteritems():
-                if not exists(path) or mtime(path) > lmtime:
-                    self.status = 'reload'
-                    thread.interrupt_main()
-                    break
+            if not self.parent_alive():
+                return self.interrupt('error')
+            if loaded != self.loaded(): # Modules and templates load lazily
+                files, loaded = self.project_files(), self.loaded()
+                for path in set(map(os.path.dirname, files)) - dirs:
+                    inotify.watch(path)
+                    dirs.add(path)
+            if not files.intersection(inotify.read(self.interval)): continue
+            while inotify.read(self.debounce): pass
+            return self.interrupt('reload')
+
+    def poll(self):
+        mtimes, loaded = {}, None
+        while not self.status:
+            if not self.parent_alive():
+                return self.interrupt('error')
+            if loaded != self.loaded():
+                for path in self.project_files():
+                    if path not in mtimes:
+                        mtimes[path] = os.stat(path).st_mtime
+                loaded = self.loaded()
+            for path, lmtime in mtimes.iteritems():
+                if not os.path.exists(path) or os.stat(path).st_mtime > lmtime:
+                    return self.interrupt('reload')
             time.sleep(self.interval)
-    
+
     def __enter__(self):
         self.start()
     
@@ -2777,10 +4003,22 @@ def template(*args, **kwargs):
     or directly (as keyword arguments).
     '''
     tpl = args[0] if args else None
-    template_adapter = kwargs.pop('template_adapter', SimpleTemplate)
+    options = {}
+    for key in ('template_adapter', 'template_settings', 'template_lookup'):
+        if key in kwargs: options[key] = kwargs.pop(key)
+    tpl = load_template(tpl, **options)
+    for dictarg in args[1:]: kwargs.update(dictarg)
+    return tpl.render(kwargs)
+
+def load_template(tpl, template_adapter=SimpleTemplate, template_settings={},
+                  template_lookup=None):
+    '''
+    Load, compile and cache a template without rendering it. Takes the same
+    first parameter and ``template_*`` keyword arguments as :func:`template`.
+    '''
     if tpl not in TEMPLATES or DEBUG:
-        settings = kwargs.pop('template_settings', {})
-        lookup = kwargs.pop('template_lookup', TEMPLATE_PATH)
+        settings, lookup = template_settings, template_lookup
+        if lookup is None: lookup = TEMPLATE_PATH
         if isinstance(tpl, template_adapter):
             TEMPLATES[tpl] = tpl
             if settings: TEMPLATES[tpl].prepare(**settings)
@@ -2790,8 +4028,7 @@ def template(*args, **kwargs):
             TEMPLATES[tpl] = template_adapter(name=tpl, lookup=lookup, **settings)
     if not TEMPLATES[tpl]:
         abort(500, 'Template (%s) not found' % tpl)
-    for dictarg in args[1:]: kwargs.update(dictarg)
-    return TEMPLATES[tpl].render(kwargs)
+    return TEMPLATES[tpl]
 
 mako_template = functools.partial(template, template_adapter=MakoTemplate)
 cheetah_template = functools.partial(template, template_adapter=CheetahTemplate)
@@ -1,36 +1,214 @@
+import collections
+import itertools
+import threading
+import time
+
 import bottle
 
 from bottle import request, response, route, Jinja2Template
 from bottle import install, uninstall
 
-from json import dumps as json_dumps
+# Use the fastest JSON encoder available: simplejson only beats the standard
+# library if its C speedups are compiled in.
+try:
+    from simplejson import _speedups
+    from simplejson import dumps as json_dumps
+except ImportError:
+    from json import dumps as json_dumps
 
 ###############################################################################
 #                      fix  bottle return json                               #
 ###############################################################################
 
+def iterjson(obj, dumps=json_dumps, bufsize=8192):
+    """
+    Encode a dict or list as JSON and yield the result in chunks of about
+    bufsize bytes. Each top-level item is encoded on its own with dumps, so
+    the whole document is never held in memory at once.
+    """
+    if isinstance(obj, dict):
+        start, end = '{', '}'
+        items = (dumps({key: value})[1:-1] for key, value in obj.iteritems())
+    else:
+        start, end = '[', ']'
+        items = (dumps(value) for value in obj)
+    buf, size = [start], 1
+    for item in items:
+        if size > 1: buf.append(', ')
+        buf.append(item)
+        size += len(item) + 2
+        if size >= bufsize:
+            yield ''.join(buf)
+            buf, size = [], 2
+    buf.append(end)
+    yield ''.join(buf)
+
+
 class JSONAPIPlugin(object):
+    """
+    Serialize dict and list results as JSON. Only routes declared with
+    json=True (e.g. @get('/categories.json', json=True)) are wrapped.
+    Large results are streamed in chunks instead of being encoded into one
+    big string.
+    """
     name = 'jsonapi'
     api  = 2
 
-    def __init__(self, json_dumps=json_dumps):
+    def __init__(self, json_dumps=json_dumps, bufsize=8192):
         uninstall('json')
         self.json_dumps = json_dumps
+        self.bufsize = bufsize
 
-    def apply(self, callback, context):
-        dumps = self.json_dumps
-        if not dumps: return callback
+    def apply(self, callback, route):
+        dumps, bufsize = self.json_dumps, self.bufsize
+        if not dumps or not route.config.get('json'): return callback
         def wrapper(*a, **ka):
             rv = callback(*a, **ka)
-            if isinstance(rv, dict) or isinstance(rv, list):
-                #Attempt to serialize, raises exception on failure
-                json_response = dumps(rv)
-                #Set content type only if serialization succesful
-                response.content_type = 'application/json'
-                return json_response
-            return rv
+            if not isinstance(rv, (dict, list)): return rv
+            #Encode the first chunks right away, so that small results are
+            #returned as a single string and most errors are raised before
+            #the content type is set
+            chunks = iterjson(rv, dumps, bufsize)
+            first = next(chunks)
+            second = next(chunks, None)
+            response.content_type = 'application/json'
+            if second is None: return first
+            return itertools.chain((first, second), chunks)
+        return wrapper
+
+
+###############################################################################
+#                      per route timing                                       #
+###############################################################################
+class StatsPlugin(object):
+    """
+    Record per route where the time of a request goes. Together with
+    middlewares.StatsMiddleware, which has to wrap the whole application,
+    each request is split into these phases (in milliseconds):
+
+      route     from the start of the request to the route callback
+      handler   the route callback, without template rendering
+      template  the functions wrapped with timed('template', ...)
+      cast      from the end of the callback to the response headers, which
+                includes the encoding of the result
+      total     all of the above
+
+    App Engine API calls (datastore_v3, memcache, ...) are counted per
+    request. report() returns the mean of each phase and the p50/p95/p99
+    of the total over the last `window` requests of each route.
+    Streamed response bodies are sent after the headers and not included.
+    """
+    name = 'stats'
+    api  = 2
+
+    phases = ('route', 'handler', 'template', 'cast', 'total')
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.routes = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hooked = False
+
+    def setup(self, app):
+        if self.hooked: return
+        try:
+            from google.appengine.api import apiproxy_stub_map
+        except ImportError:
+            return
+        local = self.local
+        def count_rpc(service, call, request, response):
+            timing = getattr(local, 'timing', None)
+            if timing is not None:
+                rpc = timing.setdefault('rpc', {})
+                rpc[service] = rpc.get(service, 0) + 1
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('stats', count_rpc)
+        self.hooked = True
+
+    def apply(self, callback, route):
+        key, local = '%s %s' % (route.method, route.rule), self.local
+        def wrapper(*a, **ka):
+            timing = getattr(local, 'timing', None)
+            if timing is None: return callback(*a, **ka)
+            timing['key'] = key
+            timing['handler_start'] = time.time()
+            try:
+                return callback(*a, **ka)
+            finally:
+                timing['handler_end'] = time.time()
         return wrapper
 
+    def timed(self, phase, func):
+        """
+        Wrap func, so that its run time is counted as phase (e.g. 'template')
+        and not as part of the handler.
+        """
+        local = self.local
+        def wrapper(*a, **ka):
+            timing = getattr(local, 'timing', None)
+            if timing is None: return func(*a, **ka)
+            start = time.time()
+            try:
+                return func(*a, **ka)
+            finally:
+                timing[phase] = timing.get(phase, 0.0) + time.time() - start
+        return wrapper
+
+    def start(self):
+        """ Called by the middleware when a request comes in. """
+        self.local.timing = {'start': time.time()}
+
+    def stop(self):
+        """
+        Called by the middleware before the response headers are sent.
+        Record the request and return a Server-Timing header value.
+        """
+        timing, self.local.timing = getattr(self.local, 'timing', None), None
+        if timing is None: return None
+        now = time.time()
+        start = timing['start']
+        handler_start = timing.get('handler_start', now)
+        handler_end = timing.get('handler_end', handler_start)
+        template = timing.get('template', 0.0)
+        ms = {'route': (handler_start - start) * 1000,
+              'handler': (handler_end - handler_start - template) * 1000,
+              'template': template * 1000,
+              'cast': (now - handler_end) * 1000,
+              'total': (now - start) * 1000}
+        rpc = timing.get('rpc', {})
+        key = timing.get('key', '(no route)')
+        with self.lock:
+            stats = self.routes.get(key)
+            if stats is None:
+                stats = self.routes[key] = {'count': 0, 'rpc': {},
+                    'time': dict.fromkeys(self.phases, 0.0),
+                    'samples': collections.deque(maxlen=self.window)}
+            stats['count'] += 1
+            for phase in self.phases:
+                stats['time'][phase] += ms[phase]
+            for service, calls in rpc.iteritems():
+                stats['rpc'][service] = stats['rpc'].get(service, 0) + calls
+            stats['samples'].append(ms['total'])
+        metrics = ['%s;dur=%.2f' % (phase, ms[phase]) for phase in self.phases]
+        metrics += ['%s;desc="%d calls"' % item for item in sorted(rpc.items())]
+        return ', '.join(metrics)
+
+    def report(self):
+        """ Return a summary of all routes, e.g. for a JSON route. """
+        result = {}
+        with self.lock:
+            for key, stats in self.routes.iteritems():
+                count, samples = stats['count'], sorted(stats['samples'])
+                summary = result[key] = {'count': count}
+                summary['mean_ms'] = dict((phase, round(total / count, 3))
+                                          for phase, total in stats['time'].iteritems())
+                for p in (50, 95, 99):
+                    index = min(len(samples) - 1, len(samples) * p // 100)
+                    summary['p%d_ms' % p] = round(samples[index], 3)
+                summary['rpc_per_request'] = dict((service, round(float(calls) / count, 2))
+                                                  for service, calls in stats['rpc'].iteritems())
+        return result
+
 
 ###############################################################################
 #                      fix  bottle jinja2 template                            #
@@ -36,6 +36,8 @@ version_info = (2,1,0, "final")
 import re
 import codecs
 import sys
+import shutil
+import tempfile
 import logging
 import util
 from preprocessors import build_preprocessors
@@ -46,7 +48,7 @@ from postprocessors import build_postprocessors
 from extensions import Extension
 from searializers import to_html_string, to_xhtml_string
 
-__all__ = ['Markdown', 'markdown', 'markdownFromFile']
+__all__ = ['Markdown', 'markdown', 'markdownFromFile', 'convert_many']
 
 logger = logging.getLogger('MARKDOWN')
 
@@ -75,6 +77,19 @@ class Markdown:
 
     ESCAPED_CHARS = ['\\', '`', '*', '_', '{', '}', '[', ']', 
                     '(', ')', '>', '#', '+', '-', '.', '!']
+
+    # Streaming conversion (see `iter_convert`) only starts a new chunk at a
+    # line which follows a blank line and can't continue the block before
+    # it: not indented, not a list item, blockquote, definition, raw html or
+    # meta-data line, and not inside a fenced code block or raw html block.
+    stream_chunk_size = 64 * 1024
+    STREAM_CONTINUATION_RE = re.compile(r'[ \t]|[*+-]([ \t]|$)|\d+\.([ \t]|$)'
+                                        r'|[>:<]|[A-Za-z0-9_-]+:')
+    STREAM_FENCE_RE = re.compile(r'(~{3,}|`{3,})')
+    STREAM_HTML_RE = re.compile(r'<(!--|[^>\s/]+)')
+    # Reference, footnote and abbreviation definitions are removed before
+    # the blocks are parsed, so they neither start nor separate blocks.
+    STREAM_DEFINITION_RE = re.compile(r'[ ]{0,3}\*?\[[^\]]*\]:')
     
     def __init__(self, *args, **kwargs):
         """
@@ -256,6 +271,13 @@ class Markdown:
            has been serialized into text.
         5. The output is written to a string.
 
+        """
+        return self._convert(source).strip()
+
+    def _convert(self, source):
+        """
+        Do the work of `convert`, leaving the whitespace at either end of
+        the output in place: `iter_convert` joins chunks with it.
         """
 
         # Fixup the source text
@@ -307,9 +329,127 @@ class Markdown:
         for pp in self.postprocessors.values():
             output = pp.run(output)
 
-        return output.strip()
+        return output
+
+    def scan_references(self, lines):
+        """
+        Collect the reference definitions from an iterable of lines into
+        `self.references` without keeping the lines themselves.
+
+        This is the pre-scan which lets `iter_convert` resolve references
+        defined anywhere in the document, including after their first use.
 
-    def convertFile(self, input=None, output=None, encoding=None):
+        """
+        candidates = []
+        for line, boundary, raw in self._classify_lines(lines):
+            # footnote definitions are not references
+            if not raw and ']:' in line \
+               and not line.lstrip().startswith('[^'):
+                candidates.append(line)
+        if 'reference' in self.preprocessors:
+            self.preprocessors['reference'].run(candidates)
+        return self
+
+    def _classify_lines(self, lines):
+        """
+        Yield `(line, boundary, raw)` for each line, where `boundary` tells
+        whether a chunk may start at that line and `raw` whether it is part
+        of a fenced code block or raw html block.
+        """
+        fence = None
+        html_tag = None
+        html_depth = 0
+        prev_blank = True
+        for line in lines:
+            line = line.rstrip('\r\n')
+            blank = not line.strip()
+            boundary = False
+            m = self.STREAM_FENCE_RE.match(line)
+            if fence is not None:
+                if m and m.group(1).startswith(fence):
+                    fence = None
+                raw = True
+            elif html_tag is not None:
+                html_depth += self._html_depth(html_tag, line)
+                if html_depth <= 0:
+                    html_tag = None
+                raw = True
+            elif self.STREAM_DEFINITION_RE.match(line):
+                yield line, False, False
+                continue
+            else:
+                raw = False
+                if prev_blank and not blank:
+                    boundary = not self.STREAM_CONTINUATION_RE.match(line)
+                    if m:
+                        fence = m.group(1)
+                        raw = True
+                    else:
+                        hm = self.STREAM_HTML_RE.match(line)
+                        if hm and (hm.group(1) == '!--' or 
+                                   util.isBlockLevel(hm.group(1).lower())):
+                            html_tag = hm.group(1)
+                            html_depth = self._html_depth(html_tag, line)
+                            if html_depth <= 0:
+                                html_tag = None
+                            raw = True
+            yield line, boundary, raw
+            prev_blank = blank
+
+    def _iter_chunks(self, lines):
+        """ Group lines into chunks which can be converted on their own. """
+        chunk = []
+        size = 0
+        for line, boundary, raw in self._classify_lines(lines):
+            if boundary and size >= self.stream_chunk_size:
+                yield chunk
+                chunk = []
+                size = 0
+            chunk.append(line)
+            size += len(line) + 1
+        if chunk:
+            yield chunk
+
+    def _html_depth(self, tag, line):
+        """ Return how many `tag` elements a line opens less those it closes. """
+        if tag == '!--':
+            return line.count('<!--') - line.count('-->')
+        opened = len(re.findall(r'<%s(?=[\s/>]|$)' % re.escape(tag), line))
+        return opened - line.count('</%s>' % tag)
+
+    def iter_convert(self, lines):
+        """
+        Convert an iterable of lines a chunk at a time, yielding the HTML of
+        each chunk as soon as it is done.
+
+        Only one chunk (of roughly `stream_chunk_size` characters) is held in
+        memory at a time. Chunks are only cut between top-level blocks, and
+        each chunk is converted like a document of its own which shares the
+        reference definitions already in `self.references` (see
+        `scan_references`). Extensions which need the document as a whole,
+        such as toc or footnotes, only see the chunk they are in.
+
+        Joined together, the yielded strings are the HTML `convert` gives
+        for the whole document, save for those extensions and for a raw html
+        block or fence which `convert` would read on past a blank line into
+        the next block.
+
+        """
+        references = self.references.copy()
+        separator = u""
+        for chunk in self._iter_chunks(lines):
+            self.reset()
+            self.references.update(references)
+            html = self._convert(u"\n".join(chunk))
+            stripped = html.strip()
+            if stripped:
+                yield separator + stripped
+                # a raw html block ends with one more newline than other
+                # blocks, convert only strips it at the end of the document
+                separator = u"\n" + html[len(html.rstrip()):]
+
+    def convertFile(self, input=None, output=None, encoding=None,
+                    stream=False):
         """Converts a markdown file and returns the HTML as a unicode string.
 
         Decodes the file using the provided encoding (defaults to utf-8),
@@ -327,11 +467,17 @@ class Markdown:
         * input: File object or path. Reads from stdin if `None`.
         * output: File object or path. Writes to stdout if `None`.
         * encoding: Encoding of input and output files. Defaults to utf-8.
+        * stream: Convert the input a chunk at a time with bounded memory,
+          see `iter_convert`. The input is read twice, so a stream which is
+          not a file name is spooled to a temporary file first.
 
         """
 
         encoding = encoding or "utf-8"
 
+        if stream:
+            return self._convertFileStream(input, output, encoding)
+
         # Read the source
         if isinstance(input, basestring):
             input_file = codecs.open(input, mode="r", encoding=encoding)
@@ -358,13 +504,83 @@ class Markdown:
 
         return self
 
+    def _convertFileStream(self, input, output, encoding):
+        """ Streaming version of `convertFile`. """
+        spool = None
+        if not isinstance(input, basestring):
+            spool = tempfile.TemporaryFile()
+            shutil.copyfileobj(input or sys.stdin, spool)
+
+        def read_lines():
+            if spool:
+                spool.seek(0)
+                input_file = codecs.getreader(encoding)(spool)
+            else:
+                input_file = codecs.open(input, mode="r", encoding=encoding)
+            try:
+                for line in self._split_lines(input_file):
+                    yield line
+            finally:
+                if not spool:
+                    input_file.close()
+
+        if isinstance(output, basestring):
+            output_file = codecs.open(output, "w", 
+                                      encoding=encoding, 
+                                      errors="xmlcharrefreplace")
+            write = output_file.write
+        else:
+            output_file = None
+            output = output or sys.stdout
+            write = lambda html: output.write(
+                html.encode(encoding, "xmlcharrefreplace"))
+
+        try:
+            self.reset()
+            self.scan_references(read_lines())
+            for html in self.iter_convert(read_lines()):
+                write(html)
+        finally:
+            if spool:
+                spool.close()
+            if output_file:
+                output_file.close()
+
+        return self
+
+    def _split_lines(self, input_file, size=64 * 1024):
+        """
+        Read a decoded file a block at a time and yield its lines, splitting
+        on the same line endings as `convert`.
+        """
+        buf = u''
+        first = True
+        while True:
+            data = input_file.read(size)
+            if not data:
+                break
+            if first:
+                data = data.lstrip(u'\ufeff') # remove the byte-order mark
+                first = False
+            buf += data
+            # hold back a trailing \r which may be the start of a \r\n
+            end = len(buf) - 1 if buf.endswith(u'\r') else len(buf)
+            lines = buf[:end].replace(u"\r\n", u"\n").replace(u"\r", u"\n")
+            lines = lines.split(u"\n")
+            buf = lines.pop() + buf[end:]
+            for line in lines:
+                yield line
+        if buf:
+            for line in buf.replace(u"\r", u"\n").split(u"\n"):
+                yield line
+
 
 """
 EXPORTED FUNCTIONS
 =============================================================================
 
-Those are the two functions we really mean to export: markdown() and
-markdownFromFile().
+Those are the functions we really mean to export: markdown(),
+markdownFromFile() and convert_many().
 """
 
 def markdown(text, *args, **kwargs):
@@ -397,6 +613,7 @@ def markdownFromFile(*args, **kwargs):
     * input: a file name or readable object.
     * output: a file name or writable object.
     * encoding: Encoding of input and output.
+    * stream: Convert with bounded memory, see `Markdown.convertFile`.
     * Any arguments accepted by the Markdown class.
     
     """
@@ -413,5 +630,66 @@ def markdownFromFile(*args, **kwargs):
     md = Markdown(**kwargs)
     md.convertFile(kwargs.get('input', None), 
                    kwargs.get('output', None),
-                   kwargs.get('encoding', None))
+                   kwargs.get('encoding', None),
+                   kwargs.get('stream', False))
+
+
+# Each worker process of convert_many() builds its Markdown instance once
+# and reuses it for every document it is handed.
+_worker_md = None
+
+def _init_worker(kwargs):
+    global _worker_md
+    _worker_md = Markdown(**kwargs)
 
+def _convert_in_worker(text):
+    try:
+        return _worker_md.convert(text)
+    finally:
+        _worker_md.reset()
+
+
+def convert_many(texts, workers=None, chunksize=1, **kwargs):
+    """Convert many markdown strings, yielding HTML in input order.
+
+    This is meant for batch jobs (imports, re-rendering a whole site). The
+    documents are spread over a pool of worker processes, each holding a
+    prebuilt Markdown instance, and results are yielded as soon as the next
+    one in order is ready. Where `multiprocessing` is not available (App
+    Engine, for one) or `workers` is 1, the documents are converted in this
+    process with a single reused Markdown instance instead.
+
+    Keyword arguments:
+
+    * texts: An iterable of markdown formatted strings.
+    * workers: Number of worker processes. Defaults to the number of CPUs.
+    * chunksize: Number of documents handed to a worker at a time.
+    * Any arguments accepted by the Markdown class. Extensions given as
+      instances must be picklable; extension names always are.
+
+    Returns: A generator of HTML documents as strings.
+
+    """
+    if workers != 1:
+        try:
+            import multiprocessing
+        except ImportError:
+            workers = 1
+
+    if workers == 1:
+        md = Markdown(**kwargs)
+        for text in texts:
+            try:
+                html = md.convert(text)
+            finally:
+                md.reset()
+            yield html
+        return
+
+    pool = multiprocessing.Pool(workers, _init_worker, (kwargs,))
+    try:
+        for html in pool.imap(_convert_in_worker, texts, chunksize):
+            yield html
+    finally:
+        pool.terminate()
+        pool.join()
@@ -6,6 +6,9 @@ COMMAND-LINE SPECIFIC STUFF
 
 import markdown
 import sys
+import os
+import codecs
+from itertools import izip
 import optparse
 
 import logging
@@ -18,7 +21,9 @@ def parse_options():
     Define and parse `optparse` options for command-line usage.
     """
     usage = """%prog [options] [INPUTFILE]
-       (STDIN is assumed if no INPUTFILE is given)"""
+       (STDIN is assumed if no INPUTFILE is given)
+       (if INPUTFILE is a directory, each of its markdown files is
+        converted to an .html file in the OUTPUT_FILE directory)"""
     desc = "A Python implementation of John Gruber's Markdown. " \
            "http://www.freewisdom.org/projects/python-markdown/"
     ver = "%%prog %s" % markdown.version
@@ -49,6 +54,14 @@ def parse_options():
     parser.add_option("-n", "--no_lazy_ol", dest="lazy_ol", 
                       action='store_false', default=True,
                       help="Observe number of first item of ordered lists.")
+    parser.add_option("--stream", dest="stream", action="store_true",
+                      default=False,
+                      help="Convert the input a chunk at a time to bound "
+                           "memory use on large files.")
+    parser.add_option("-j", "--workers", dest="workers", type="int",
+                      help="Convert a directory with WORKERS processes. "
+                           "Defaults to the number of CPUs.",
+                      metavar="WORKERS")
 
     (options, args) = parser.parse_args()
 
@@ -66,7 +79,45 @@ def parse_options():
             'extensions': options.extensions,
             'encoding': options.encoding,
             'output_format': options.output_format,
-            'lazy_ol': options.lazy_ol}, options.verbose
+            'lazy_ol': options.lazy_ol,
+            'stream': options.stream,
+            'workers': options.workers}, options.verbose
+
+MARKDOWN_EXTENSIONS = ('.md', '.markdown', '.mdown', '.mkd', '.txt')
+
+def convertDirectory(input_dir, output_dir=None, encoding=None, workers=None,
+                     **kwargs):
+    """
+    Convert every markdown file in `input_dir` with `markdown.convert_many`,
+    writing each result to a same-named .html file in `output_dir` (which
+    defaults to `input_dir`).
+    """
+    encoding = encoding or "utf-8"
+    output_dir = output_dir or input_dir
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    names = sorted(name for name in os.listdir(input_dir)
+                   if os.path.splitext(name)[1].lower() in MARKDOWN_EXTENSIONS
+                   and os.path.isfile(os.path.join(input_dir, name)))
+
+    def read(name):
+        input_file = codecs.open(os.path.join(input_dir, name),
+                                 mode="r", encoding=encoding)
+        try:
+            return input_file.read().lstrip(u'\ufeff')
+        finally:
+            input_file.close()
+
+    texts = (read(name) for name in names)
+    results = markdown.convert_many(texts, workers=workers, **kwargs)
+    for name, html in izip(names, results):
+        output_path = os.path.join(output_dir,
+                                   os.path.splitext(name)[0] + '.html')
+        output_file = codecs.open(output_path, "w", encoding=encoding,
+                                  errors="xmlcharrefreplace")
+        output_file.write(html)
+        output_file.close()
+        logger.info("Converted %s to %s" % (name, output_path))
 
 def run():
     """Run Markdown from the command line."""
@@ -78,7 +129,17 @@ def run():
     logger.addHandler(logging.StreamHandler())
 
     # Run
-    markdown.markdownFromFile(**options)
+    workers = options.pop('workers')
+    if isinstance(options['input'], basestring) \
+       and os.path.isdir(options['input']):
+        output = options.pop('output')
+        options.pop('stream')
+        if not isinstance(output, basestring):
+            output = None
+        convertDirectory(options.pop('input'), output, workers=workers,
+                         **options)
+    else:
+        markdown.markdownFromFile(**options)
 
 if __name__ == '__main__':
     # Support running module as a commandline command. 
@@ -35,16 +35,30 @@ class AbbrExtension(markdown.Extension):
 
     def extendMarkdown(self, md, md_globals):
         """ Insert AbbrPreprocessor before ReferencePreprocessor. """
-        md.preprocessors.add('abbr', AbbrPreprocessor(md), '<reference')
+        md.registerExtension(self)
+        self.md = md
+        self.abbrs = {}
+        md.preprocessors.add('abbr', AbbrPreprocessor(self), '<reference')
+
+    def reset(self):
+        """ Forget the abbreviations of the last document. """
+        self.abbrs.clear()
+        if 'abbr' in self.md.inlinePatterns:
+            del self.md.inlinePatterns['abbr']
         
            
 class AbbrPreprocessor(markdown.preprocessors.Preprocessor):
     """ Abbreviation Preprocessor - parse text for abbr references. """
 
+    def __init__(self, abbr):
+        markdown.preprocessors.Preprocessor.__init__(self, abbr.md)
+        self.abbrs = abbr.abbrs
+
     def run(self, lines):
         '''
         Find and remove all Abbreviation references from the text.
-        Each reference is set as a new AbbrPattern in the markdown instance.
+        All abbreviations are matched by a single AbbrPattern in the markdown
+        instance, which looks up the title of the matched text.
         
         '''
         new_text = []
@@ -52,40 +66,55 @@ class AbbrPreprocessor(markdown.preprocessors.Preprocessor):
             m = ABBR_REF_RE.match(line)
             if m:
                 abbr = m.group('abbr').strip()
-                title = m.group('title').strip()
-                self.markdown.inlinePatterns['abbr-%s'%abbr] = \
-                    AbbrPattern(self._generate_pattern(abbr), title)
+                if abbr:
+                    self.abbrs[abbr] = m.group('title').strip()
             else:
                 new_text.append(line)
+        if self.abbrs:
+            self.markdown.inlinePatterns['abbr'] = \
+                AbbrPattern(self._generate_pattern(self.abbrs), self.abbrs)
         return new_text
     
-    def _generate_pattern(self, text):
-        '''
-        Given a string, returns an regex pattern to match that string. 
+    def _generate_pattern(self, abbrs):
+        r'''
+        Given some strings, returns one regex pattern to match any of them.
         
-        'HTML' -> r'(?P<abbr>[H][T][M][L])' 
+        ['HTML', 'HTML5', 'REF'] -> r'(?P<abbr>\b(?:HTML(?:5)?|REF)\b)'
         
-        Note: we force each char as a literal match (in brackets) as we don't 
-        know what they will be beforehand.
+        Note: the strings are nested as a trie, so matching costs about the
+        same for 2 or 200 abbreviations. A longer abbreviation wins over its
+        prefix.
 
         '''
-        chars = list(text)
-        for i in range(len(chars)):
-            chars[i] = r'[%s]' % chars[i]
-        return r'(?P<abbr>\b%s\b)' % (r''.join(chars))
+        trie = {}
+        for text in abbrs:
+            node = trie
+            for char in text:
+                node = node.setdefault(char, {})
+            node[''] = None # End of an abbreviation
+        def build(node):
+            alternatives = [re.escape(char) + build(node[char])
+                            for char in sorted(node) if char]
+            if not alternatives:
+                return ''
+            if len(alternatives) == 1 and '' not in node:
+                return alternatives[0]
+            pattern = r'(?:%s)' % r'|'.join(alternatives)
+            return pattern + '?' if '' in node else pattern
+        return r'(?P<abbr>\b%s\b)' % build(trie)
 
 
 class AbbrPattern(markdown.inlinepatterns.Pattern):
     """ Abbreviation inline pattern. """
 
-    def __init__(self, pattern, title):
+    def __init__(self, pattern, titles):
         markdown.inlinepatterns.Pattern.__init__(self, pattern)
-        self.title = title
+        self.titles = titles
 
     def handleMatch(self, m):
         abbr = etree.Element('abbr')
         abbr.text = m.group('abbr')
-        abbr.set('title', self.title)
+        abbr.set('title', self.titles[abbr.text])
         return abbr
 
 def makeExtension(configs=None):
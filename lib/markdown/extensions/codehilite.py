@@ -21,6 +21,7 @@ Dependencies:
 """
 
 import markdown
+from hashlib import md5
 try:
     from pygments import highlight
     from pygments.lexers import get_lexer_by_name, guess_lexer, TextLexer
@@ -29,6 +30,16 @@ try:
 except ImportError:
     pygments = False
 
+# Lexers and formatters are reusable once built, so they are kept for the
+# life of the process, keyed by language and formatter options. The html of
+# recently highlighted code is memoized by a hash of the code and options.
+_lexers = {}
+_formatters = {}
+_hilited = {}
+HILITE_CACHE_SIZE = 256
+# Only this many characters of a code block are looked at to guess its language.
+GUESS_LANG_LIMIT = 2048
+
 # ------------------ The Main CodeHilite Class ----------------------
 class CodeHilite:
     """
@@ -42,7 +53,8 @@ class CodeHilite:
 
     * linenos: (Boolen) Turn line numbering 'on' or 'off' (off by default).
 
-    * guess_lang: (Boolen) Turn language auto-detection 'on' or 'off' (on by default).
+    * guess_lang: (Boolen) Turn language auto-detection 'on' or 'off' (off by default).
+      Only the first GUESS_LANG_LIMIT characters are used to guess.
 
     * css_class: Set class name of wrapper div ('codehilite' by default).
 
@@ -54,7 +66,7 @@ class CodeHilite:
 
     """
 
-    def __init__(self, src=None, linenos=False, guess_lang=True,
+    def __init__(self, src=None, linenos=False, guess_lang=False,
                 css_class="codehilite", lang=None, style='default',
                 noclasses=False, tab_length=4):
         self.src = src
@@ -83,21 +95,19 @@ class CodeHilite:
             self._getLang()
 
         if pygments:
-            try:
-                lexer = get_lexer_by_name(self.lang)
-            except ValueError:
-                try:
-                    if self.guess_lang:
-                        lexer = guess_lexer(self.src)
-                    else:
-                        lexer = TextLexer()
-                except ValueError:
-                    lexer = TextLexer()
-            formatter = HtmlFormatter(linenos=self.linenos,
-                                      cssclass=self.css_class,
-                                      style=self.style,
-                                      noclasses=self.noclasses)
-            return highlight(self.src, lexer, formatter)
+            src = self.src
+            if isinstance(src, unicode):
+                src = src.encode('utf-8')
+            key = (md5(src).hexdigest(), self.lang, self.guess_lang,
+                   self.linenos, self.css_class, self.style, self.noclasses)
+            html = _hilited.get(key)
+            if html is None:
+                html = highlight(self.src, self._getLexer(),
+                                 self._getFormatter())
+                if len(_hilited) >= HILITE_CACHE_SIZE:
+                    _hilited.clear()
+                _hilited[key] = html
+            return html
         else:
             # just escape and build markup usable by JS highlighting libs
             txt = self.src.replace('&', '&amp;')
@@ -115,6 +125,37 @@ class CodeHilite:
             return '<pre class="%s"><code%s>%s</code></pre>\n'% \
                         (self.css_class, class_str, txt)
 
+    def _getLexer(self):
+        """ Return a (cached) lexer for the language, guessing if allowed. """
+        try:
+            lexer = _lexers[self.lang]
+        except KeyError:
+            try:
+                lexer = get_lexer_by_name(self.lang)
+            except ValueError:
+                lexer = None
+            _lexers[self.lang] = lexer
+        if lexer is None:
+            if self.guess_lang:
+                try:
+                    return guess_lexer(self.src[:GUESS_LANG_LIMIT])
+                except ValueError:
+                    pass
+            lexer = TextLexer()
+        return lexer
+
+    def _getFormatter(self):
+        """ Return a (cached) html formatter for the current options. """
+        key = (self.linenos, self.css_class, self.style, self.noclasses)
+        formatter = _formatters.get(key)
+        if formatter is None:
+            formatter = _formatters[key] = HtmlFormatter(
+                                      linenos=self.linenos,
+                                      cssclass=self.css_class,
+                                      style=self.style,
+                                      noclasses=self.noclasses)
+        return formatter
+
     def _getLang(self):
         """
         Determines language of a code block from shebang line and whether said
@@ -198,7 +239,7 @@ class CodeHiliteExtension(markdown.Extension):
         # define default configs
         self.config = {
             'force_linenos' : [False, "Force line numbers - Default: False"],
-            'guess_lang' : [True, "Automatic language detection - Default: True"],
+            'guess_lang' : [False, "Automatic language detection - Default: False"],
             'css_class' : ["codehilite",
                            "Set class name for wrapper <div> - Default: codehilite"],
             'pygments_style' : ['default', 'Pygments HTML Formatter Style (Colorscheme) - Default: default'],
@@ -107,33 +107,35 @@ class FencedBlockPreprocessor(markdown.preprocessors.Preprocessor):
             self.checked_for_codehilite = True
 
         text = "\n".join(lines)
-        while 1:
-            m = FENCED_BLOCK_RE.search(text)
-            if m:
-                lang = ''
-                if m.group('lang'):
-                    lang = LANG_TAG % m.group('lang')
-
-                # If config is not empty, then the codehighlite extension
-                # is enabled, so we call it to highlite the code
-                if self.codehilite_conf:
-                    highliter = CodeHilite(m.group('code'),
-                            linenos=self.codehilite_conf['force_linenos'],
-                            guess_lang=self.codehilite_conf['guess_lang'],
-                            css_class=self.codehilite_conf['css_class'],
-                            style=self.codehilite_conf['pygments_style'],
-                            lang=(m.group('lang') or None),
-                            noclasses=self.codehilite_conf['noclasses'])
-
-                    code = highliter.hilite()
-                else:
-                    code = CODE_WRAP % (lang, self._escape(m.group('code')))
-
-                placeholder = self.markdown.htmlStash.store(code, safe=True)
-                text = '%s\n%s\n%s'% (text[:m.start()], placeholder, text[m.end():])
+        # Scan forward once, collecting the text between the blocks and their
+        # placeholders instead of rebuilding the document for each block.
+        output = []
+        pos = 0
+        for m in FENCED_BLOCK_RE.finditer(text):
+            lang = ''
+            if m.group('lang'):
+                lang = LANG_TAG % m.group('lang')
+
+            # If config is not empty, then the codehighlite extension
+            # is enabled, so we call it to highlite the code
+            if self.codehilite_conf:
+                highliter = CodeHilite(m.group('code'),
+                        linenos=self.codehilite_conf['force_linenos'],
+                        guess_lang=self.codehilite_conf['guess_lang'],
+                        css_class=self.codehilite_conf['css_class'],
+                        style=self.codehilite_conf['pygments_style'],
+                        lang=(m.group('lang') or None),
+                        noclasses=self.codehilite_conf['noclasses'])
+
+                code = highliter.hilite()
             else:
-                break
-        return text.split("\n")
+                code = CODE_WRAP % (lang, self._escape(m.group('code')))
+
+            placeholder = self.markdown.htmlStash.store(code, safe=True)
+            output.extend((text[pos:m.start()], '\n', placeholder, '\n'))
+            pos = m.end()
+        output.append(text[pos:])
+        return ''.join(output).split("\n")
 
     def _escape(self, txt):
         """ basic html escaping """
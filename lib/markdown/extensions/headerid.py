@@ -107,6 +107,71 @@ def unique(id, ids):
     return id
 
 
+HEADER_TAGS = frozenset(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+
+
+class HeadingIndex(object):
+    """ The headers and ids of a document, collected in a single walk over
+    the tree. Shared by the headerid and toc extensions, see get_index().
+
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.headers = []   # Header elements in document order
+        self.children = []  # (parent, child) pairs, as toc iterates them
+        self.ids = set()    # All ids in the document
+        self.counters = {}  # id -> n, if id_1 ... id_n are all taken
+        self._text = {}
+        for parent in root.getiterator():
+            if parent.tag in HEADER_TAGS:
+                self.headers.append(parent)
+            if 'id' in parent.attrib:
+                self.ids.add(parent.attrib['id'])
+            for child in parent:
+                self.children.append((parent, child))
+
+    def text(self, elem):
+        """ Return the text of a header, without markup. """
+        if elem not in self._text:
+            self._text[elem] = u''.join(itertext(elem))
+        return self._text[elem]
+
+    def unique(self, id):
+        """ Reserve id or, if it is taken, the next free id_1, id_2 ...
+        Gives the same ids as unique() without looping over all of them.
+
+        """
+        if id in self.ids:
+            m = IDCOUNT_RE.match(id)
+            if m:
+                base, n = m.group(1), int(m.group(2))
+            else:
+                base, n = id, 0
+            known = self.counters.get(base, 0)
+            start = n = (known if n <= known else n) + 1
+            while '%s_%d' % (base, n) in self.ids:
+                n += 1
+            if start == known + 1:
+                self.counters[base] = n
+            id = '%s_%d' % (base, n)
+        self.ids.add(id)
+        return id
+
+
+def get_index(md, root):
+    """ Return the HeadingIndex of the document, building it on first use. """
+    index = getattr(md, 'headingIndex', None)
+    if index is None or index.root is not root:
+        index = md.headingIndex = HeadingIndex(root)
+    return index
+
+
+def reset_index(md):
+    """ Drop the HeadingIndex of the last document, see get_index(). """
+    md.headingIndex = None
+
+
 def itertext(elem):
     """ Loop through all children and return text only. 
     
@@ -125,25 +190,20 @@ def itertext(elem):
 class HeaderIdTreeprocessor(markdown.treeprocessors.Treeprocessor):
     """ Assign IDs to headers. """
 
-    IDs = set()
-
     def run(self, doc):
         start_level, force_id = self._get_meta()
         slugify = self.config['slugify']
         sep = self.config['separator']
-        for elem in doc.getiterator():
-            if elem.tag in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-                if force_id:
-                    if "id" in elem.attrib:
-                        id = elem.id
-                    else:
-                        id = slugify(''.join(itertext(elem)), sep)
-                    elem.set('id', unique(id, self.IDs))
-                if start_level:
-                    level = int(elem.tag[-1]) + start_level
-                    if level > 6:
-                        level = 6
-                    elem.tag = 'h%d' % level
+        index = get_index(self.md, doc)
+        for elem in index.headers:
+            if force_id and "id" not in elem.attrib:
+                id = slugify(index.text(elem), sep)
+                elem.set('id', index.unique(id))
+            if start_level:
+                level = int(elem.tag[-1]) + start_level
+                if level > 6:
+                    level = 6
+                elem.tag = 'h%d' % level
 
 
     def _get_meta(self):
@@ -182,6 +242,7 @@ class HeaderIdExtension (markdown.Extension):
 
     def extendMarkdown(self, md, md_globals):
         md.registerExtension(self)
+        self.md = md
         self.processor = HeaderIdTreeprocessor()
         self.processor.md = md
         self.processor.config = self.getConfigs()
@@ -189,7 +250,7 @@ class HeaderIdExtension (markdown.Extension):
         md.treeprocessors.add('headerid', self.processor, '>inline')
 
     def reset(self):
-        self.processor.IDs = []
+        reset_index(self.md)
 
 
 def makeExtension(configs=None):
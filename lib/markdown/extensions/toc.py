@@ -10,21 +10,11 @@ Dependencies:
 """
 import markdown
 from markdown.util import etree
-from markdown.extensions.headerid import slugify, unique, itertext
-
-import re
+from markdown.extensions.headerid import slugify, get_index, reset_index, HEADER_TAGS
 
 
 class TocTreeprocessor(markdown.treeprocessors.Treeprocessor):
-    # Iterator wrapper to get parent and child all at once
-    def iterparent(self, root):
-        for parent in root.getiterator():
-            for child in parent:
-                yield parent, child
-
     def run(self, doc):
-        marker_found = False
-
         div = etree.Element("div")
         div.attrib["class"] = "toc"
         last_li = None
@@ -37,18 +27,16 @@ class TocTreeprocessor(markdown.treeprocessors.Treeprocessor):
 
         level = 0
         list_stack=[div]
-        header_rgx = re.compile("[Hh][123456]")
 
-        # Get a list of id attributes
-        used_ids = []
-        for c in doc.getiterator():
-            if "id" in c.attrib:
-                used_ids.append(c.attrib["id"])
+        # The headers and ids, shared with the headerid extension
+        index = get_index(self.markdown, doc)
 
-        for (p, c) in self.iterparent(doc):
-            text = ''.join(itertext(c)).strip()
-            if not text:
-                continue
+        for (p, c) in index.children:
+            is_header = c.tag in HEADER_TAGS
+            if is_header:
+                text = index.text(c).strip()
+                if not text:
+                    continue
 
             # To keep the output from screwing up the
             # validation by putting a <div> inside of a <p>
@@ -57,15 +45,15 @@ class TocTreeprocessor(markdown.treeprocessors.Treeprocessor):
             # would causes an enless loop of placing a new TOC 
             # inside previously generated TOC.
 
-            if c.text and c.text.strip() == self.config["marker"] and \
-               not header_rgx.match(c.tag) and c.tag not in ['pre', 'code']:
+            if not is_header and c.text and \
+               c.text.strip() == self.config["marker"] and \
+               c.tag not in ['pre', 'code']:
                 for i in range(len(p)):
                     if p[i] == c:
                         p[i] = div
                         break
-                marker_found = True
                     
-            if header_rgx.match(c.tag):
+            if is_header:
                 try:
                     tag_level = int(c.tag[-1])
                     
@@ -87,7 +75,7 @@ class TocTreeprocessor(markdown.treeprocessors.Treeprocessor):
 
                     # Do not override pre-existing ids 
                     if not "id" in c.attrib:
-                        id = unique(self.config["slugify"](text, '-'), used_ids)
+                        id = index.unique(self.config["slugify"](text, '-'))
                         c.attrib["id"] = id
                     else:
                         id = c.attrib["id"]
@@ -113,8 +101,11 @@ class TocTreeprocessor(markdown.treeprocessors.Treeprocessor):
                 except IndexError:
                     # We have bad ordering of headers. Just move on.
                     pass
-        if not marker_found:
-            # searialize and attach to markdown instance.
+        if not index.headers:
+            self.markdown.toc = ''
+        else:
+            # Searialize and attach to markdown instance, also if the toc
+            # is in the document, so that it can be stored on its own.
             prettify = self.markdown.treeprocessors.get('prettify')
             if prettify: prettify.run(div)
             toc = self.markdown.serializer(div)
@@ -141,6 +132,8 @@ class TocExtension(markdown.Extension):
             self.setConfig(key, value)
 
     def extendMarkdown(self, md, md_globals):
+        md.registerExtension(self)
+        self.md = md
         tocext = TocTreeprocessor(md)
         tocext.config = self.getConfigs()
         # Headerid ext is set to '>inline'. With this set to '<prettify',
@@ -149,6 +142,9 @@ class TocExtension(markdown.Extension):
         # attr_list extension. This must come last because we don't want
         # to redefine ids after toc is created. But we do want toc prettified.
         md.treeprocessors.add("toc", tocext, "<prettify")
+
+    def reset(self):
+        reset_index(self.md)
 	
 def makeExtension(configs={}):
     return TocExtension(configs=configs)
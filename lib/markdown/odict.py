@@ -4,10 +4,18 @@ class OrderedDict(dict):
     
     Copied from Django's SortedDict with some modifications.
 
+    The position of each key and a tuple of the values in order are cached
+    and only rebuilt after the dictionary has been mutated, so positional
+    lookups (`index`, `value_for_index`, `snapshot`) don't rescan `keyOrder`.
+    Code which assigns to `keyOrder` directly must call `_changed()`.
+
     """
     def __new__(cls, *args, **kwargs):
         instance = super(OrderedDict, cls).__new__(cls, *args, **kwargs)
         instance.keyOrder = []
+        instance._positions = {}
+        instance._snapshot = ()
+        instance._scanned = False
         return instance
 
     def __init__(self, data=None):
@@ -21,6 +29,20 @@ class OrderedDict(dict):
             for key, value in data:
                 if key not in self.keyOrder:
                     self.keyOrder.append(key)
+        self._changed()
+
+    def _changed(self):
+        """ Drop the cached positions and values after a mutation. """
+        self._positions = None
+        self._snapshot = None
+        self._scanned = False
+
+    def _append_key(self, key):
+        """ Add a new key to the end, keeping cached positions valid. """
+        self.keyOrder.append(key)
+        if self._positions is not None:
+            self._positions[key] = len(self.keyOrder) - 1
+        self._snapshot = None
 
     def __deepcopy__(self, memo):
         from copy import deepcopy
@@ -28,30 +50,34 @@ class OrderedDict(dict):
                                for key, value in self.iteritems()])
 
     def __setitem__(self, key, value):
-        super(OrderedDict, self).__setitem__(key, value)
-        if key not in self.keyOrder:
-            self.keyOrder.append(key)
+        if key in self:
+            super(OrderedDict, self).__setitem__(key, value)
+            self._snapshot = None
+        else:
+            super(OrderedDict, self).__setitem__(key, value)
+            self._append_key(key)
 
     def __delitem__(self, key):
         super(OrderedDict, self).__delitem__(key)
-        self.keyOrder.remove(key)
+        del self.keyOrder[self.index(key)]
+        self._changed()
 
     def __iter__(self):
         for k in self.keyOrder:
             yield k
 
     def pop(self, k, *args):
-        result = super(OrderedDict, self).pop(k, *args)
-        try:
-            self.keyOrder.remove(k)
-        except ValueError:
+        if k not in self:
             # Key wasn't in the dictionary in the first place. No problem.
-            pass
-        return result
+            return super(OrderedDict, self).pop(k, *args)
+        del self.keyOrder[self.index(k)]
+        self._changed()
+        return super(OrderedDict, self).pop(k)
 
     def popitem(self):
         result = super(OrderedDict, self).popitem()
-        self.keyOrder.remove(result[0])
+        del self.keyOrder[self.index(result[0])]
+        self._changed()
         return result
 
     def items(self):
@@ -68,40 +94,54 @@ class OrderedDict(dict):
         return iter(self.keyOrder)
 
     def values(self):
-        return [super(OrderedDict, self).__getitem__(k) for k in self.keyOrder]
+        return list(self.snapshot())
 
     def itervalues(self):
-        for key in self.keyOrder:
-            yield super(OrderedDict, self).__getitem__(key)
+        return iter(self.snapshot())
+
+    def snapshot(self):
+        """
+        Return an immutable tuple of the values in order.
+
+        The tuple is built once and reused until the dictionary is mutated,
+        so hot loops can walk it (or index into it) as a plain sequence.
+
+        """
+        if self._snapshot is None:
+            getitem = super(OrderedDict, self).__getitem__
+            self._snapshot = tuple([getitem(k) for k in self.keyOrder])
+        return self._snapshot
 
     def update(self, dict_):
         for k, v in dict_.items():
             self.__setitem__(k, v)
 
     def setdefault(self, key, default):
-        if key not in self.keyOrder:
-            self.keyOrder.append(key)
+        if key not in self:
+            self._append_key(key)
         return super(OrderedDict, self).setdefault(key, default)
 
     def value_for_index(self, index):
         """Return the value of the item at the given zero-based index."""
-        return self[self.keyOrder[index]]
+        return self.snapshot()[index]
 
     def insert(self, index, key, value):
         """Insert the key, value pair before the item with the given index."""
-        if key in self.keyOrder:
-            n = self.keyOrder.index(key)
+        if key in self:
+            n = self.index(key)
             del self.keyOrder[n]
             if n < index:
                 index -= 1
         self.keyOrder.insert(index, key)
         super(OrderedDict, self).__setitem__(key, value)
+        self._changed()
 
     def copy(self):
         """Return a copy of this object."""
         # This way of initializing the copy means it works for subclasses, too.
         obj = self.__class__(self)
         obj.keyOrder = self.keyOrder[:]
+        obj._changed()
         return obj
 
     def __repr__(self):
@@ -114,10 +154,22 @@ class OrderedDict(dict):
     def clear(self):
         super(OrderedDict, self).clear()
         self.keyOrder = []
+        self._changed()
 
     def index(self, key):
         """ Return the index of a given key. """
-        return self.keyOrder.index(key)
+        if self._positions is None:
+            if not self._scanned:
+                # A single lookup right after a mutation (as in `add`) is
+                # cheaper as a plain scan; only index repeated lookups.
+                self._scanned = True
+                return self.keyOrder.index(key)
+            self._positions = dict(zip(self.keyOrder,
+                                       xrange(len(self.keyOrder))))
+        try:
+            return self._positions[key]
+        except KeyError:
+            raise ValueError('%r is not in list' % (key,))
 
     def index_for_location(self, location):
         """ Return index or None for a given location. """
@@ -148,15 +200,18 @@ class OrderedDict(dict):
 
     def link(self, key, location):
         """ Change location of an existing item. """
-        n = self.keyOrder.index(key)
+        n = self.index(key)
         del self.keyOrder[n]
-        i = self.index_for_location(location)
+        self._changed()
         try:
+            i = self.index_for_location(location)
             if i is not None:
                 self.keyOrder.insert(i, key)
             else:
                 self.keyOrder.append(key)
-        except Error:
+        except Exception:
             # restore to prevent data loss and reraise
             self.keyOrder.insert(n, key)
-            raise Error
+            raise
+        finally:
+            self._changed()
@@ -81,28 +81,43 @@ class HtmlBlockPreprocessor(Preprocessor):
             tag = block[1:].replace(">", " ", 1).split()[0].lower()
             return tag, len(tag)+2, {}
 
-    def _recursive_tagfind(self, ltag, rtag, start_index, block):
+    def _nested_tagfind(self, ltag, rtag, start_index, block):
+        """
+        Return the index just past the `rtag` which closes the element
+        opened before `start_index`, or -1 if there is none.
+
+        Nested `ltag`s are tracked with a depth counter and the block is
+        scanned forward once, so deeply nested or unbalanced html stays
+        linear and never hits the recursion limit.
+
+        """
+        depth = 0
+        j = block.find(ltag, start_index)
         while 1:
             i = block.find(rtag, start_index)
             if i == -1:
                 return -1
-            j = block.find(ltag, start_index) 
-            # if no ltag, or rtag found before another ltag, return index
+            # if no ltag, or rtag found before another ltag
             if (j > i or j == -1):
-                return i + len(rtag)
-            # another ltag found before rtag, use end of ltag as starting
-            # point and search again
-            j = block.find('>', j)
-            start_index = self._recursive_tagfind(ltag, rtag, j + 1, block)
-            if start_index == -1:
-                # HTML potentially malformed- ltag has no corresponding 
-                # rtag
-                return -1
+                if not depth:
+                    return i + len(rtag)
+                depth -= 1
+                start_index = i + len(rtag)
+            else:
+                # another ltag found before rtag, use end of ltag as
+                # starting point and search again
+                j = block.find('>', j)
+                if j == -1:
+                    # HTML potentially malformed- ltag is never closed
+                    return -1
+                depth += 1
+                start_index = j + 1
+                j = block.find(ltag, start_index)
 
     def _get_right_tag(self, left_tag, left_index, block):
         for p in self.right_tag_patterns:
             tag = p % left_tag
-            i = self._recursive_tagfind("<%s" % left_tag, tag, left_index, block)
+            i = self._nested_tagfind("<%s" % left_tag, tag, left_index, block)
             if i > 2:
                 return tag.lstrip("<").rstrip(">"), i
         return block.rstrip()[-left_index:-1].lower(), len(block)
@@ -126,17 +141,19 @@ class HtmlBlockPreprocessor(Preprocessor):
     def run(self, lines):
         text = "\n".join(lines)
         new_blocks = []
+        # keep the blocks reversed so that taking the next one (and pushing
+        # back a remainder) is a cheap pop/append at the end of the list
         text = text.split("\n\n")
+        text.reverse()
         items = []
         left_tag = ''
         right_tag = ''
         in_tag = False # flag
 
         while text:
-            block = text[0]
+            block = text.pop()
             if block.startswith("\n"):
                 block = block[1:]
-            text = text[1:]
 
             if block.startswith("\n"):
                 block = block[1:]
@@ -158,7 +175,7 @@ class HtmlBlockPreprocessor(Preprocessor):
                     
                     if data_index < len(block) \
                         and util.isBlockLevel(left_tag): 
-                        text.insert(0, block[data_index:])
+                        text.append(block[data_index:])
                         block = block[:data_index]
 
                     if not (util.isBlockLevel(left_tag) \
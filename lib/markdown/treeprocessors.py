@@ -104,10 +104,10 @@ class InlineProcessor(Treeprocessor):
         """
         if not isinstance(data, util.AtomicString):
             startIndex = 0
-            while patternIndex < len(self.markdown.inlinePatterns):
+            patterns = self.markdown.inlinePatterns.snapshot()
+            while patternIndex < len(patterns):
                 data, matched, startIndex = self.__applyPattern(
-                    self.markdown.inlinePatterns.value_for_index(patternIndex),
-                    data, patternIndex, startIndex)
+                    patterns[patternIndex], data, patternIndex, startIndex)
                 if not matched:
                     patternIndex += 1
         return data
@@ -8,10 +8,37 @@ class MethodRewriteMiddleware(object):
     def __call__(self, environ, start_response):
         request = bottle.BaseRequest(environ)
 
-        if self.input_name in request.POST:
-            method = request.POST[self.input_name].upper()
+        try:
+            post = request.POST
+        except bottle.HTTPError:
+            # Malformed or oversized body, the app answers with the error
+            post = {}
+
+        if self.input_name in post:
+            method = post[self.input_name].upper()
 
             if method in ['GET', 'POST', 'PUT', 'DELETE']:
                 environ['REQUEST_METHOD'] = method
 
-        return self.app(environ, start_response)
\ No newline at end of file
+        return self.app(environ, start_response)
+
+
+class StatsMiddleware(object):
+    """
+    Time every request for a bottleext.StatsPlugin and add a Server-Timing
+    header to the response. Has to be the outermost middleware.
+    """
+    def __init__(self, app, stats, header=True):
+        self.app = app
+        self.stats = stats
+        self.header = header
+
+    def __call__(self, environ, start_response):
+        stats, header = self.stats, self.header
+        def timed_start_response(status, headerlist, exc_info=None):
+            value = stats.stop()
+            if header and value:
+                headerlist = headerlist + [('Server-Timing', value)]
+            return start_response(status, headerlist, exc_info)
+        stats.start()
+        return self.app(environ, timed_start_response)
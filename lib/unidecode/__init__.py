@@ -13,42 +13,114 @@ In Python 3, a standard string object will be returned. If you need bytes, use:
 >>> unidecode("Κνωσός").encode("ascii")
 b'Knosos'
 """
+import os
+import re
+import struct
+
 Cache = {}
 
-def unidecode(string):
-    """Transliterate an Unicode object into an ASCII string
+# All tables packed into one file by unidecode/pack.py, read on first use
+TABLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tables.bin')
+_packed = None
 
-    >>> unidecode(u"\u5317\u4EB0")
-    "Bei Jing "
-    """
+def _read_packed():
+    """Return the contents of tables.bin, or '' if it has not been built."""
+    global _packed
+    if _packed is None:
+        try:
+            f = open(TABLES, 'rb')
+            try:
+                data = f.read()
+            finally:
+                f.close()
+        except IOError:
+            data = ''
+        if data[:4] != 'UDT1':
+            data = ''
+        _packed = data
+    return _packed
 
-    retval = []
+def _load_table(section):
+    """Return the transliterations of a 256 codepoint section, or None."""
+    data = _read_packed()
+    if not data: # Not built: import the section module instead
+        try:
+            mod = __import__('unidecode.x%03x'%(section), [], [], ['data'])
+        except ImportError:
+            return None
+        return mod.data
 
-    for char in string:
-        codepoint = ord(char)
+    sections, = struct.unpack_from('>H', data, 4)
+    if section >= sections:
+        return None
+    start, end = struct.unpack_from('>2I', data, 6 + 4 * section)
+    if start == end:
+        return None
+    return tuple(data[start:end].split('\xff'))
 
-        if codepoint < 0x80: # Basic ASCII
-            retval.append(str(char))
-            continue
-        
-        if codepoint > 0xeffff:
-            continue # Characters in Private Use Area and above are ignored
+def _lookup(codepoint):
+    """Return the transliteration of a codepoint, or None to drop it."""
+    if codepoint > 0xeffff:
+        return None # No data on characters in Private Use Area and above.
 
-        section = codepoint >> 8   # Chop off the last two hex digits
-        position = codepoint % 256 # Last two hex digits
+    section = codepoint >> 8   # Chop off the last two hex digits
+    position = codepoint % 256 # Last two hex digits
 
-        try:
-            table = Cache[section]
-        except KeyError:
-            try:
-                mod = __import__('unidecode.x%03x'%(section), [], [], ['data'])
-            except ImportError:
-                Cache[section] = None
-                continue   # No match: ignore this character and carry on.
+    try:
+        table = Cache[section]
+    except KeyError:
+        Cache[section] = table = _load_table(section)
 
-            Cache[section] = table = mod.data
+    if table and len(table) > position:
+        return table[position].decode('ascii')
+    return None
 
-        if table and len(table) > position:
-            retval.append( table[position] )
+# Transliterations by codepoint in the form unicode.translate takes them,
+# filled on first use of each codepoint and cleared when it grows too big
+_translations = {}
+_max_translations = 32768
 
-    return ''.join(retval)
+# Non-ASCII characters, together with short ASCII gaps between them so that
+# text in another script is translated in one piece rather than word by word
+_non_ascii = re.compile(u'[^\x00-\x7f]+(?:[\x00-\x7f]{1,8}[^\x00-\x7f]+)*')
+
+def _transliterate(string):
+    """Copy ASCII runs as they are and translate only the spans between them."""
+    retval = []
+    pos = 0
+    for m in _non_ascii.finditer(string):
+        retval.append(string[pos:m.start()])
+        retval.append(m.group().translate(_translations))
+        pos = m.end()
+    retval.append(string[pos:])
+    return u''.join(retval)
+
+def unidecode(string):
+    """Transliterate an Unicode object into an ASCII string
+
+    >>> unidecode(u"\u5317\u4EB0")
+    "Bei Jing "
+    """
+    try:
+        return string.encode('ascii') # Nothing to do for plain ASCII
+    except UnicodeError:
+        pass
+
+    if isinstance(string, str): # Bytes are read as latin-1 codepoints
+        string = string.decode('latin-1')
+
+    retval = _transliterate(string)
+    try:
+        return retval.encode('ascii')
+    except UnicodeError:
+        pass
+
+    # unicode.translate keeps the characters it has no entry for, so some of
+    # them are new: look them up and translate again.
+    if len(_translations) > _max_translations:
+        _translations.clear()
+    for char in set(string):
+        codepoint = ord(char)
+        if codepoint > 0x7f and codepoint not in _translations:
+            _translations[codepoint] = _lookup(codepoint)
+    return _transliterate(string).encode('ascii')
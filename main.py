@@ -9,11 +9,13 @@ package_dir_path = os.path.join(os.path.dirname(__file__), package_dir)
 sys.path.insert(0, package_dir_path)
 
 import bottle
-from middlewares import MethodRewriteMiddleware
+from middlewares import MethodRewriteMiddleware, StatsMiddleware
 from app import handlers, config
 
 app = bottle.default_app()
 myapp = MethodRewriteMiddleware(app)
+if handlers.stats:
+    myapp = StatsMiddleware(myapp, handlers.stats)
 
 bottle.debug(config.DEV_MODE) # Only for debugging purposes, set to False in production
 bottle.run(app = myapp, server = 'gae')